@@ -11,20 +11,23 @@ Sections:
 How to use (quickstart):
 1. Backend (development, local):
    - Create and activate a Python venv: `python -m venv venv && source venv/bin/activate` (Linux/macOS) or `venv\Scripts\activate` (Windows)
-   - Install deps: `pip install fastapi uvicorn sqlmodel passlib[bcrypt] python-jose[cryptography]`
+   - Install deps: `pip install fastapi uvicorn sqlmodel passlib[bcrypt] python-jose[cryptography] aiosqlite asyncpg`
    - Save the backend section below into `backend/app.py` and run: `python backend/app.py` or `uvicorn backend.app:app --reload`
    - Backend runs on http://127.0.0.1:8000 by default.
 
 2. Mobile prototype (desktop test or Android packaging later):
    - Install deps for prototype: `pip install kivy requests plyer`
    - Save the mobile section below into `mobile/main.py` and run: `python mobile/main.py`
-   - The prototype logs in (or registers) using the email/password you enter and polls `/reminders` every 60s, showing local notifications when reminders are returned.
+   - The prototype logs in (or registers) using the email/password you enter and keeps an on-device SQLite copy of your data, kept current through `/sync`, so screens work offline; writes made offline are queued and sent when the network returns.
+   - Reminders are computed on the device from that copy and fire as local notifications at the exact dose time, with no polling.
 
 Notes / MVP decisions for this phase:
   - Authentication: simple JWT; token expiry configurable. Passwords hashed with bcrypt.
-  - Scheduling: Server returns reminders for the current day within a configurable window (default 15 minutes before, 5 after). No push-notifications yet; the app polls `/reminders`.
+  - Scheduling: Server returns reminders for the current day within a configurable window (default 15 minutes before, 5 after). Clients can also have them pushed over `/reminders/stream` (Server-Sent Events); the bundled prototype schedules them on the device instead.
   - Storage: SQLite for MVP. Later switch to PostgreSQL when scaling.
   - Notification delivery: local notifications via plyer (when running on device). Later we will add FCM/APNs push notifications.
+  - Observability: every response carries a `Server-Timing` header with its SQL statement count and DB time; statements slower than SLOW_QUERY_MS are logged with their parameters, and METRICS_ENABLED=1 exposes Prometheus metrics at `/metrics`.
+  - Logging: JSON lines on stderr (LOG_FORMAT=text for plain), written by a background thread and tagged with the request id (X-Request-ID); levels via LOG_LEVEL and per logger via LOG_LEVELS, e.g. `medbuddy.reminders=DEBUG`.
 
 ---
 
@@ -35,17 +38,44 @@ Notes / MVP decisions for this phase:
 from typing import Optional, List
 from sqlmodel import SQLModel, Field, create_engine, Session, select
 from datetime import date, time, datetime, timedelta
-from fastapi import FastAPI, Depends, HTTPException, status
-from pydantic import BaseModel, EmailStr
+from fastapi import FastAPI, Depends, HTTPException, Header, Request, Response, status
+from fastapi.responses import StreamingResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, EmailStr, ValidationError
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import uvicorn
 from fastapi import Query
 from zoneinfo import ZoneInfo
-from sqlalchemy import text, select, func
+from sqlalchemy import text, select, func, case, and_, or_, tuple_, delete, update, inspect, event, cast, bindparam, Integer, Index, UniqueConstraint
+from sqlalchemy.orm import selectinload
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy import exc as sa_exc
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.dialects import sqlite as sqlite_dialect, postgresql as postgresql_dialect
 # --- CONFIG ---
 #DATABASE_URL = "sqlite:///./meds.db"
 import os
+import re
+import sys
+import json
+import uuid
+from queue import SimpleQueue
+import atexit
+import heapq
+import itertools
+import base64
+import hashlib
+import asyncio
+import logging
+import logging.handlers
+import threading
+import contextvars
+from collections import OrderedDict
+from time import monotonic, perf_counter
+from concurrent.futures import ProcessPoolExecutor
 
 # get path to repo root (parent of backend/) for render
 # BASE_DIR = os.path.dirname(os.path.abspath(__file__))  # backend/
@@ -56,18 +86,298 @@ import os
 from sqlmodel import create_engine
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
 
-# Only pass SQLite-specific args if SQLite is used
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(DATABASE_URL)
+# Connection pool / engine tuning (size Postgres max_connections >= workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) * 2 engines)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Compiled SQL cache (SQLAlchemy) and prepared statement cache (asyncpg)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+SQLITE_BUSY_TIMEOUT = float(os.getenv("SQLITE_BUSY_TIMEOUT", "5"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
 
 SECRET_KEY = "change-me-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
+# How many days ahead dose occurrences are materialized for /reminders
+DOSE_HORIZON_DAYS = int(os.getenv("DOSE_HORIZON_DAYS", "14"))
+# Default /reminders window: a dose is listed from REMINDER_LEAD_MINUTES before it until REMINDER_GRACE_MINUTES
+# after it. The SSE push fires as it enters that window and the connect snapshot uses the same window.
+REMINDER_LEAD_MINUTES = 5
+REMINDER_GRACE_MINUTES = 15
+SSE_KEEPALIVE_SECONDS = 15
+# Each uvicorn worker keeps its own reminder heap; this often it checks whether any medication changed
+# (through any worker) and, if so, rebuilds the heap from the database. 0 turns the check off, which is
+# safe for a single worker since create_med/delete_medication keep its heap current.
+REMINDER_REFRESH_SECONDS = int(os.getenv("REMINDER_REFRESH_SECONDS", "300"))
+# Upper bound for the ?limit= of GET /vitals
+VITALS_PAGE_MAX = 500
+# Typed vitals columns that /vitals/summary and /vitals/series work on
+VITALS_METRICS = ("systolic", "diastolic", "heart_rate", "temperature_c")
+# Default look-back of /vitals/summary per bucket size
+VITALS_SUMMARY_DEFAULT_RANGE = {"hour": timedelta(days=7), "day": timedelta(days=90), "week": timedelta(days=365)}
+# Default look-back of /vitals/series
+VITALS_SERIES_DEFAULT_RANGE = timedelta(days=90)
+# /vitals/series ranges with more readings than this are averaged into this many time buckets in SQL before LTTB
+VITALS_SERIES_SQL_BUCKETS = 4000
+# A dose taken more than this long after its scheduled time counts as late
+ADHERENCE_LATE_MINUTES = int(os.getenv("ADHERENCE_LATE_MINUTES", "60"))
+# How often past days are closed (missed = scheduled - taken); hourly catches every timezone's midnight
+ADHERENCE_CLOSE_INTERVAL_SECONDS = int(os.getenv("ADHERENCE_CLOSE_INTERVAL_SECONDS", "3600"))
+# Operations accepted by one POST /taken/batch
+TAKEN_BATCH_MAX = 500
+# Change-log entries returned by one GET /sync
+SYNC_PAGE_MAX = 1000
+# Keys per statement when compacting the change log (keeps under the driver's bind-parameter limit)
+SYNC_CHUNK = 1000
+# POST /vitals/bulk: rows per INSERT, and the body cap for (non-streamed) JSON arrays
+VITALS_BULK_CHUNK = 500
+VITALS_BULK_MAX_BYTES = int(os.getenv("VITALS_BULK_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# bcrypt cost factor; hashes with a different cost are upgraded on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Hashing runs in a separate process pool; 0 workers hashes inline (handy for local debugging)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Hash/verify calls allowed in flight before /register and /token answer 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "16"))
+# Responses smaller than this go out uncompressed; SSE (text/event-stream) is never compressed
+GZIP_MINIMUM_SIZE = int(os.getenv("GZIP_MINIMUM_SIZE", "1000"))
+GZIP_COMPRESSLEVEL = int(os.getenv("GZIP_COMPRESSLEVEL", "6"))
+# Authenticated users are cached by id so most requests skip the User lookup
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+# Statements slower than this are logged with their parameters; 0 disables the slow-query log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# GET /metrics (Prometheus text format) is only mounted when enabled; numbers are per worker process
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-logger overrides, e.g. "medbuddy.request=WARNING,medbuddy.reminders=DEBUG"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# "json" (one object per line) or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
 
-engine = create_engine(DATABASE_URL, echo=False)
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# ----------------------------
+# Logging: handlers run on a background listener thread, so request code only enqueues records
+# ----------------------------
+_request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+_LOG_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the id of the request being handled ("-" outside requests)."""
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; fields passed via extra= become top-level keys."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in _LOG_RECORD_ATTRS)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class _LogQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Merge args and render tracebacks on the calling thread (they may not survive the hand-off),
+        # but leave the final formatting to the listener
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_log_listener: Optional[logging.handlers.QueueListener] = None
+
+def configure_logging():
+    """Route the root logger through a queue to a stderr handler; idempotent."""
+    global _log_listener
+    if _log_listener is not None:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "text":
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+    else:
+        handler.setFormatter(JsonFormatter())
+    log_queue = SimpleQueue()
+    queue_handler = _LogQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    for item in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        name, _, level = item.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    _log_listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
+configure_logging()
+logger = logging.getLogger("medbuddy")
+request_logger = logging.getLogger("medbuddy.request")
+reminder_logger = logging.getLogger("medbuddy.reminders")
+slow_query_logger = logging.getLogger("medbuddy.slow_query")
+
+class PoolStats:
+    """Checkout wait times and timeouts for one engine's connection pool."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def record(self, waited: float, timed_out: bool = False):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            if timed_out:
+                self.timeouts += 1
+
+    def snapshot(self, pool) -> dict:
+        capacity = pool.size() + DB_MAX_OVERFLOW
+        with self._lock:
+            return {
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": max(pool.overflow(), 0),
+                "saturation": round(pool.checkedout() / capacity, 3) if capacity else None,
+                "checkouts": self.checkouts,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+                "timeouts": self.timeouts,
+            }
+
+class _TimedCheckoutMixin:
+    stats: PoolStats
+
+    def _do_get(self):
+        started = monotonic()
+        try:
+            conn = super()._do_get()
+        except sa_exc.TimeoutError:
+            self.stats.record(monotonic() - started, timed_out=True)
+            raise
+        self.stats.record(monotonic() - started)
+        return conn
+
+class TimedQueuePool(_TimedCheckoutMixin, QueuePool):
+    stats = PoolStats()
+
+class TimedAsyncQueuePool(_TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    stats = PoolStats()
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+def async_database_url(url: str):
+    """Map DATABASE_URL onto its async driver (aiosqlite / asyncpg), plus any connect args that need translating."""
+    url = make_url(url)
+    connect_args = {}
+    if url.get_backend_name() == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    elif url.get_backend_name() == "postgresql":
+        # asyncpg has no sslmode query parameter (Render URLs carry ?sslmode=require)
+        query = dict(url.query)
+        sslmode = query.pop("sslmode", None)
+        if sslmode:
+            connect_args["ssl"] = sslmode
+        query.setdefault("prepared_statement_cache_size", str(DB_STATEMENT_CACHE_SIZE))
+        url = url.set(drivername="postgresql+asyncpg", query=query)
+    return url, connect_args
+
+def make_engine(url: str, is_async: bool = False):
+    """Build the sync or async engine for DATABASE_URL with the pool settings and SQLite pragmas above."""
+    is_sqlite = make_url(url).get_backend_name() == "sqlite"
+    in_memory = is_sqlite and make_url(url).database in (None, "", ":memory:")
+    if is_async:
+        url, connect_args = async_database_url(url)
+    else:
+        connect_args = {}
+    if is_sqlite:
+        connect_args["timeout"] = SQLITE_BUSY_TIMEOUT
+        if not is_async:
+            connect_args["check_same_thread"] = False
+    kwargs = {"echo": False, "query_cache_size": DB_STATEMENT_CACHE_SIZE, "pool_pre_ping": DB_POOL_PRE_PING}
+    if not in_memory:
+        kwargs.update(
+            poolclass=TimedAsyncQueuePool if is_async else TimedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    if is_async:
+        new_engine = create_async_engine(url, connect_args=connect_args, **kwargs)
+    else:
+        new_engine = create_engine(url, connect_args=connect_args, **kwargs)
+    if is_sqlite:
+        event.listen(new_engine.sync_engine if is_async else new_engine, "connect", _set_sqlite_pragmas)
+    return new_engine
+
+engine = make_engine(DATABASE_URL)
+async_engine = make_engine(DATABASE_URL, is_async=True)
+
+# ----------------------------
+# Per-request DB instrumentation
+# ----------------------------
+
+class RequestDbStats:
+    """Statement count and time spent in the database for one request."""
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+# Set by RequestMetricsMiddleware. The object is shared (not copied) into run_sync greenlets and
+# threadpool endpoints, so statements issued there are counted against the request too.
+_request_db_stats: contextvars.ContextVar[Optional[RequestDbStats]] = contextvars.ContextVar("request_db_stats", default=None)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._medbuddy_started = perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_medbuddy_started", None)
+    if started is None:
+        return
+    elapsed = perf_counter() - started
+    stats = _request_db_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += elapsed
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_query_logger.warning(
+            "Slow query (%.1f ms): %s | params=%.1000r", elapsed * 1000, statement, parameters,
+            extra={"duration_ms": round(elapsed * 1000, 3), "statement": statement, "executemany": executemany}
+        )
+
+for _engine in (engine, async_engine.sync_engine):
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 # --- MODELS ---
 
@@ -91,13 +401,22 @@ class User(SQLModel, table=True):
 # MEDICATION
 # ----------------------------
 class Medication(SQLModel, table=True):
+    __table_args__ = (
+        # A replayed POST /meds carrying the same Idempotency-Key finds the row it created
+        Index("uq_medication_user_idempotency_key", "user_id", "idempotency_key", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    user_id: int = Field(foreign_key="user.id")
+    user_id: int = Field(foreign_key="user.id", index=True)
     name: str
     dose: Optional[str] = None
     start_date: date = Field(default_factory=date.today)
     end_date: Optional[date] = None
     quantity: Optional[int] = None
+    # Running count of Taken rows, maintained by mark_taken/unmark_taken
+    taken_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    # Client-generated key of the write that created this row (None for rows created without one)
+    idempotency_key: Optional[str] = None
 
     # Relationships
     user: Optional[User] = Relationship(back_populates="medications")
@@ -110,7 +429,7 @@ class Medication(SQLModel, table=True):
 # ----------------------------
 class MedicationTime(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    medication_id: int = Field(foreign_key="medication.id")
+    medication_id: int = Field(foreign_key="medication.id", index=True)
     time: time  # not string!
 
     medication: Optional[Medication] = Relationship(back_populates="times")
@@ -120,6 +439,11 @@ class MedicationTime(SQLModel, table=True):
 # TAKEN (Each actual intake)
 # ----------------------------
 class Taken(SQLModel, table=True):
+    # One intake per scheduled dose; also serves every medication_id + scheduled_for lookup
+    __table_args__ = (
+        Index("uq_taken_med_scheduled", "medication_id", "scheduled_for", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     medication_id: int = Field(foreign_key="medication.id")
     scheduled_for: datetime  # e.g. 2025-10-12T08:00:00
@@ -127,14 +451,85 @@ class Taken(SQLModel, table=True):
 
     medication: Optional[Medication] = Relationship(back_populates="taken_records")
 
+
+# ----------------------------
+# DOSE OCCURRENCE (One row per scheduled dose, in the user's local time)
+# ----------------------------
+class DoseOccurrence(SQLModel, table=True):
+    __table_args__ = (
+        UniqueConstraint("medication_id", "scheduled_for", name="uq_doseoccurrence_med_scheduled"),
+        Index("ix_doseoccurrence_user_scheduled", "user_id", "scheduled_for"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    medication_id: int = Field(foreign_key="medication.id")
+    user_id: int = Field(foreign_key="user.id")
+    scheduled_for: datetime  # naive local datetime, same convention as Taken.scheduled_for
+
+# ----------------------------
+# USER VERSION (Per-user change counters behind the ETags)
+# ----------------------------
+class UserVersion(SQLModel, table=True):
+    user_id: int = Field(foreign_key="user.id", primary_key=True)
+    meds: int = 0
+    taken: int = 0
+    vitals: int = 0
+    seq: int = 0  # last ChangeLog.seq handed out for this user
+    log_seeded: bool = False  # rows created before the change log existed have been logged
+
+# ----------------------------
+# CHANGE LOG (Latest change per record, read by /sync)
+# ----------------------------
+class ChangeLog(SQLModel, table=True):
+    __table_args__ = (
+        Index("uq_changelog_user_seq", "user_id", "seq", unique=True),
+        Index("ix_changelog_user_entity", "user_id", "entity", "entity_id"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.id")
+    seq: int  # per-user, monotonic; the /sync cursor
+    entity: str  # "medication", "medication_time", "taken" or "vitals"
+    entity_id: int
+    deleted: bool = False
+
+# ----------------------------
+# ADHERENCE DAILY (Rollup per medication per local day)
+# ----------------------------
+class AdherenceDaily(SQLModel, table=True):
+    __table_args__ = (
+        Index("uq_adherencedaily_med_day", "medication_id", "day", unique=True),
+        Index("ix_adherencedaily_user_day", "user_id", "day"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    medication_id: int = Field(foreign_key="medication.id")
+    user_id: int = Field(foreign_key="user.id")
+    day: date  # user's local date, same as DoseOccurrence.scheduled_for.date()
+    scheduled: int = 0
+    taken: int = 0
+    late: int = 0
+    missed: int = 0  # set once the day is closed
+    closed: bool = False
+
 # Vitals model
 class Vitals(SQLModel, table=True):
+    __table_args__ = (
+        # One reading per user and instant; bulk ingestion de-duplicates against it
+        Index("uq_vitals_user_record_time", "user_id", "record_time", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
     bp: Optional[str] = None
     hr: Optional[str] = None
     temp: Optional[str] = None
     record_time: datetime = Field(default_factory=datetime.now)
+    # Typed values parsed from (or supplied alongside) the free-form strings above
+    systolic: Optional[int] = None
+    diastolic: Optional[int] = None
+    heart_rate: Optional[int] = None
+    temperature_c: Optional[float] = None
 
 # --- Pydantic schemas ---
 class UserCreate(BaseModel):
@@ -162,6 +557,11 @@ class VitalsCreate(BaseModel):
     hr: Optional[str] = None
     temp: Optional[str] = None
     record_time: Optional[datetime] = None
+    # Optional typed values; when omitted they are parsed from bp/hr/temp
+    systolic: Optional[int] = None
+    diastolic: Optional[int] = None
+    heart_rate: Optional[int] = None
+    temperature_c: Optional[float] = None
 
 class VitalsRead(BaseModel):
     id: int
@@ -169,21 +569,221 @@ class VitalsRead(BaseModel):
     hr: Optional[str] = None
     temp: Optional[str] = None
     record_time: datetime
+    systolic: Optional[int] = None
+    diastolic: Optional[int] = None
+    heart_rate: Optional[int] = None
+    temperature_c: Optional[float] = None
 
 # --- Utilities ---
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    migrate_schema()
+    # Medications created before doses were materialized from start_date; a no-op once filled in
+    with Session(engine) as session:
+        backfill_doses(session)
+        session.commit()
+
+def migrate_schema():
+    # create_all() never alters existing tables, so add columns introduced after the first release here
+    med_cols = {c["name"] for c in inspect(engine).get_columns("medication")}
+    with engine.begin() as conn:
+        if "taken_count" not in med_cols:
+            conn.execute(text("ALTER TABLE medication ADD COLUMN taken_count INTEGER NOT NULL DEFAULT 0"))
+            conn.execute(text(
+                "UPDATE medication SET taken_count = "
+                "(SELECT COUNT(*) FROM taken WHERE taken.medication_id = medication.id)"
+            ))
+        if "idempotency_key" not in med_cols:
+            conn.execute(text("ALTER TABLE medication ADD COLUMN idempotency_key VARCHAR"))
+            conn.execute(text(
+                "CREATE UNIQUE INDEX IF NOT EXISTS uq_medication_user_idempotency_key "
+                "ON medication (user_id, idempotency_key)"
+            ))
+        # Older databases may hold duplicate intakes, which would block the unique index below
+        if not any(ix["name"] == "uq_taken_med_scheduled" for ix in inspect(conn).get_indexes("taken")):
+            removed = conn.execute(text(
+                "DELETE FROM taken WHERE id NOT IN "
+                "(SELECT MIN(id) FROM taken GROUP BY medication_id, scheduled_for)"
+            )).rowcount
+            if removed:
+                conn.execute(text(
+                    "UPDATE medication SET taken_count = "
+                    "(SELECT COUNT(*) FROM taken WHERE taken.medication_id = medication.id)"
+                ))
+        if not any(ix["name"] == "uq_vitals_user_record_time" for ix in inspect(conn).get_indexes("vitals")):
+            # Only exact copies are removed; readings that merely share a timestamp are kept (see below)
+            conn.execute(text(
+                "DELETE FROM vitals WHERE id NOT IN "
+                "(SELECT MIN(id) FROM vitals GROUP BY user_id, record_time, bp, hr, temp)"
+            ))
+            separate_colliding_vitals(conn)
+            # Superseded by the unique index
+            conn.execute(text("DROP INDEX IF EXISTS ix_vitals_user_record_time"))
+        if "seq" not in {c["name"] for c in inspect(conn).get_columns("userversion")}:
+            conn.execute(text("ALTER TABLE userversion ADD COLUMN seq INTEGER NOT NULL DEFAULT 0"))
+            conn.execute(text("ALTER TABLE userversion ADD COLUMN log_seeded BOOLEAN NOT NULL DEFAULT FALSE"))
+        # Indexes declared on the models after their tables were first created (works on SQLite and Postgres)
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        # Seed the adherence rollups from the doses and intakes recorded before they existed
+        if conn.execute(text("SELECT 1 FROM adherencedaily LIMIT 1")).first() is None:
+            conn.execute(text(
+                "INSERT INTO adherencedaily (medication_id, user_id, day, scheduled, taken, late, missed, closed) "
+                "SELECT medication_id, user_id, DATE(scheduled_for), COUNT(*), 0, 0, 0, FALSE "
+                "FROM doseoccurrence GROUP BY medication_id, user_id, DATE(scheduled_for)"
+            ))
+            conn.execute(text(
+                "INSERT INTO adherencedaily (medication_id, user_id, day, scheduled, taken, late, missed, closed) "
+                "SELECT taken.medication_id, medication.user_id, DATE(taken.scheduled_for), 0, COUNT(*), 0, 0, FALSE "
+                "FROM taken JOIN medication ON medication.id = taken.medication_id WHERE 1 = 1 "
+                "GROUP BY taken.medication_id, medication.user_id, DATE(taken.scheduled_for) "
+                "ON CONFLICT (medication_id, day) DO UPDATE SET taken = excluded.taken"
+            ))
+            seed_late_counts(conn)
+        if "systolic" not in {c["name"] for c in inspect(conn).get_columns("vitals")}:
+            for column, sql_type in (("systolic", "INTEGER"), ("diastolic", "INTEGER"),
+                                     ("heart_rate", "INTEGER"), ("temperature_c", "FLOAT")):
+                conn.execute(text(f"ALTER TABLE vitals ADD COLUMN {column} {sql_type}"))
+            backfill_typed_vitals(conn)
+            if conn.dialect.name == "postgresql":
+                # Physically order the heap by (user_id, record_time) so per-user range scans read few pages
+                conn.execute(text("CLUSTER vitals USING uq_vitals_user_record_time"))
+
+def seed_late_counts(conn):
+    """Fill AdherenceDaily.late for the seeded rollups; lateness depends on each user's timezone, so it is computed here."""
+    late = {}
+    rows = conn.execute(
+        select(Taken.medication_id, Taken.scheduled_for, Taken.taken_at, User.timezone)
+        .join(Medication, Medication.id == Taken.medication_id)
+        .join(User, User.id == Medication.user_id)
+        .where(Taken.taken_at != None)
+    )
+    for med_id, scheduled_for, taken_at, tz_name in rows:
+        if is_late(scheduled_for, taken_at, User(timezone=tz_name)):
+            key = (med_id, scheduled_for.date())
+            late[key] = late.get(key, 0) + 1
+    if late:
+        conn.execute(
+            update(AdherenceDaily)
+            .where(AdherenceDaily.medication_id == bindparam("med_id"), AdherenceDaily.day == bindparam("rollup_day"))
+            .values(late=bindparam("late_count")),
+            [{"med_id": med_id, "rollup_day": day, "late_count": count} for (med_id, day), count in late.items()]
+        )
+
+def separate_colliding_vitals(conn):
+    """Move readings that share (user_id, record_time) but differ in value forward by a microsecond each,
+    so the unique index can be built without dropping any of them."""
+    colliding = select(Vitals.user_id, Vitals.record_time).group_by(Vitals.user_id, Vitals.record_time).having(func.count() > 1)
+    rows = conn.execute(
+        select(Vitals.id, Vitals.user_id, Vitals.record_time)
+        .where(tuple_(Vitals.user_id, Vitals.record_time).in_(colliding))
+        .order_by(Vitals.user_id, Vitals.record_time, Vitals.id)
+    ).all()
+    previous = None
+    for vital_id, user_id, record_time in rows:
+        if (user_id, record_time) != previous:
+            previous = (user_id, record_time)  # the oldest row keeps its timestamp
+            continue
+        moved = record_time + timedelta(microseconds=1)
+        while conn.execute(select(Vitals.id).where(Vitals.user_id == user_id, Vitals.record_time == moved)).first():
+            moved += timedelta(microseconds=1)
+        conn.execute(update(Vitals).where(Vitals.id == vital_id).values(record_time=moved))
+        logger.warning("Vitals %s shared record_time %s with another reading; moved to %s", vital_id, record_time, moved)
+
+def backfill_typed_vitals(conn, batch_size: int = 1000):
+    """Parse the free-form bp/hr/temp strings of existing rows into the typed columns, batch by batch."""
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            text("SELECT id, bp, hr, temp FROM vitals WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": batch_size}
+        ).all()
+        if not rows:
+            return
+        conn.execute(
+            text("UPDATE vitals SET systolic = :systolic, diastolic = :diastolic, "
+                 "heart_rate = :heart_rate, temperature_c = :temperature_c WHERE id = :id"),
+            [{"id": row.id, **parse_vitals(row.bp, row.hr, row.temp)} for row in rows]
+        )
+        last_id = rows[-1].id
+
+_BP_RE = re.compile(r"^\s*(\d{2,3})\s*/\s*(\d{2,3})")
+_HR_RE = re.compile(r"(\d{2,3})")
+_TEMP_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*°?\s*([cCfF])?")
+
+def parse_vitals(bp: Optional[str], hr: Optional[str], temp: Optional[str]) -> dict:
+    """Typed values from the free-form strings; temperatures are normalized to Celsius, implausible values dropped."""
+    typed = {"systolic": None, "diastolic": None, "heart_rate": None, "temperature_c": None}
+    m = _BP_RE.match(bp or "")
+    if m and 50 <= int(m.group(1)) <= 300 and 20 <= int(m.group(2)) <= 200:
+        typed["systolic"], typed["diastolic"] = int(m.group(1)), int(m.group(2))
+    m = _HR_RE.search(hr or "")
+    if m and 20 <= int(m.group(1)) <= 300:
+        typed["heart_rate"] = int(m.group(1))
+    m = _TEMP_RE.match(temp or "")
+    if m:
+        value, unit = float(m.group(1)), (m.group(2) or "").upper()
+        # No unit: anything above 45 can only be Fahrenheit
+        if unit == "F" or (not unit and value > 45):
+            value = (value - 32) * 5 / 9
+        if 25 <= value <= 45:
+            typed["temperature_c"] = round(value, 2)
+    return typed
+
+def vitals_columns(vital: VitalsCreate) -> dict:
+    """Column values for a new Vitals row: explicit typed fields win over parsed ones, and fill in missing strings."""
+    typed = parse_vitals(vital.bp, vital.hr, vital.temp)
+    for key in typed:
+        if getattr(vital, key) is not None:
+            typed[key] = getattr(vital, key)
+    bp = vital.bp
+    if not bp and typed["systolic"] is not None and typed["diastolic"] is not None:
+        bp = f"{typed['systolic']}/{typed['diastolic']}"
+    hr = vital.hr or (str(typed["heart_rate"]) if typed["heart_rate"] is not None else None)
+    temp = vital.temp or (f"{typed['temperature_c']} C" if typed["temperature_c"] is not None else None)
+    return {"bp": bp, "hr": hr, "temp": temp, **typed}
+
+def to_vitals_read(v: "Vitals") -> VitalsRead:
+    return VitalsRead(id=v.id, bp=v.bp, hr=v.hr, temp=v.temp, record_time=v.record_time,
+                      systolic=v.systolic, diastolic=v.diastolic, heart_rate=v.heart_rate,
+                      temperature_c=v.temperature_c)
 
 def get_password_hash(password: str) -> str:
     # Ensure password is a string and not bytes
     if not isinstance(password, str):
         password = str(password)
-    print("Password for hashing:", password, type(password))  # Debug line
     return pwd_context.hash(password[:72])
 
 def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
+_password_pool: Optional[ProcessPoolExecutor] = None
+_password_pool_lock = threading.Lock()
+_password_slots = threading.BoundedSemaphore(PASSWORD_HASH_MAX_PENDING)
+
+def get_password_pool() -> Optional[ProcessPoolExecutor]:
+    global _password_pool
+    if PASSWORD_HASH_WORKERS <= 0:
+        return None
+    with _password_pool_lock:
+        if _password_pool is None:
+            _password_pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        return _password_pool
+
+async def run_password_task(fn, *args):
+    """Await get_password_hash/verify_password in the hashing processes without holding a request thread
+    (a worker thread stands in when PASSWORD_HASH_WORKERS is 0), shedding load once the queue is full."""
+    if not _password_slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+    try:
+        pool = get_password_pool()
+        if pool is None:
+            return await asyncio.to_thread(fn, *args)
+        return await asyncio.wrap_future(pool.submit(fn, *args))
+    finally:
+        _password_slots.release()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -194,9 +794,408 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def dialect_insert(session: Session, model):
+    """INSERT construct for the bound dialect, which gives access to ON CONFLICT."""
+    if session.get_bind().dialect.name == "postgresql":
+        return postgresql_dialect.insert(model)
+    return sqlite_dialect.insert(model)
+
+def insert_ignore(session: Session, model, rows: List[dict], conflict_cols: List[str], returning=None):
+    """INSERT rows, silently skipping any that hit the unique key on conflict_cols."""
+    if not rows:
+        return None
+    stmt = dialect_insert(session, model).on_conflict_do_nothing(index_elements=conflict_cols)
+    if returning is not None:
+        stmt = stmt.returning(*returning)
+    return session.exec(stmt, params=rows)
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    user_cache.pop(target.id)
+
+def encode_vitals_cursor(v: "Vitals") -> str:
+    raw = f"{v.record_time.isoformat()}|{v.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_vitals_cursor(cursor: str):
+    try:
+        record_time, vital_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(record_time), int(vital_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# --- Dose occurrences ---
+# user_id -> last local date that every medication of that user is materialized through
+_doses_through: dict = {}
+
+def user_today(user: "User") -> date:
+    return datetime.now(ZoneInfo(user.timezone or "Asia/Kolkata")).date()
+
+def to_local_naive(dt: datetime, user: "User") -> datetime:
+    """Normalize a client supplied datetime to the naive local time used for scheduled_for columns."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(ZoneInfo(user.timezone or "Asia/Kolkata")).replace(tzinfo=None)
+    return dt.replace(microsecond=0)
+
+def materialize_doses(session: Session, med: "Medication", times: List[time], first_day: date, last_day: date):
+    """Insert one DoseOccurrence per (day, time) of med between first_day and last_day inclusive."""
+    first_day = max(first_day, med.start_date)
+    if med.end_date:
+        last_day = min(last_day, med.end_date)
+    rows = []
+    d = first_day
+    while d <= last_day:
+        for t in times:
+            rows.append({"medication_id": med.id, "user_id": med.user_id, "scheduled_for": datetime.combine(d, t)})
+        d += timedelta(days=1)
+    if not rows:
+        return
+    inserted = insert_ignore(session, DoseOccurrence, rows, ["medication_id", "scheduled_for"],
+                             returning=[DoseOccurrence.scheduled_for]).all()
+    per_day = {}
+    for (scheduled_for,) in inserted:
+        per_day[scheduled_for.date()] = per_day.get(scheduled_for.date(), 0) + 1
+    bump_adherence(session, [
+        adherence_row(med.id, med.user_id, day, scheduled=count) for day, count in per_day.items()
+    ])
+
+# --- Versions / ETags / change log ---
+# ETag counter each synced entity belongs to
+SYNC_COLLECTIONS = {"medication": "meds", "medication_time": "meds", "taken": "taken", "vitals": "vitals"}
+
+def record_changes(session: Session, user_id: int, upserts=(), deletes=()):
+    """Log (entity, id) writes for /sync and bump the matching ETag counters, in the caller's transaction.
+
+    The UserVersion upsert row-locks the user, so seqs commit in order and a /sync cursor never skips a change.
+    Only the newest entry per record is kept, which bounds the log by the number of records.
+    """
+    latest = {key: False for key in upserts}
+    latest.update({key: True for key in deletes})
+    if not latest:
+        return
+    collections = sorted({SYNC_COLLECTIONS[entity] for entity, _ in latest})
+    stmt = dialect_insert(session, UserVersion).values(user_id=user_id, seq=len(latest), **{c: 1 for c in collections})
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_={"seq": UserVersion.seq + len(latest), **{c: getattr(UserVersion, c) + 1 for c in collections}}
+    ).returning(UserVersion.seq)
+    first_seq = session.exec(stmt).scalar() - len(latest) + 1
+    keys = list(latest)
+    for i in range(0, len(keys), SYNC_CHUNK):
+        session.exec(delete(ChangeLog).where(
+            ChangeLog.user_id == user_id,
+            tuple_(ChangeLog.entity, ChangeLog.entity_id).in_(keys[i:i + SYNC_CHUNK])
+        ))
+    session.exec(dialect_insert(session, ChangeLog), params=[
+        {"user_id": user_id, "seq": first_seq + i, "entity": entity, "entity_id": entity_id, "deleted": deleted}
+        for i, ((entity, entity_id), deleted) in enumerate(latest.items())
+    ])
+
+def seed_change_log(session: Session, user_id: int):
+    """Log every record the user already has, so /sync from cursor 0 is a full snapshot."""
+    med_ids = session.exec(select(Medication.id).where(Medication.user_id == user_id)).all()
+    upserts = [("medication", i) for i in med_ids]
+    upserts += [("medication_time", i) for i in session.exec(
+        select(MedicationTime.id).where(MedicationTime.medication_id.in_(med_ids))).all()] if med_ids else []
+    upserts += [("taken", i) for i in session.exec(
+        select(Taken.id).where(Taken.medication_id.in_(med_ids))).all()] if med_ids else []
+    upserts += [("vitals", i) for i in session.exec(select(Vitals.id).where(Vitals.user_id == user_id)).all()]
+    record_changes(session, user_id, upserts)
+    session.exec(
+        dialect_insert(session, UserVersion).values(user_id=user_id, log_seeded=True)
+        .on_conflict_do_update(index_elements=["user_id"], set_={"log_seeded": True})
+    )
+
+async def collection_etag(request: Request, session: AsyncSession, user: "User", collections, extra: str = "") -> str:
+    """Strong ETag for a user's view of collections: one primary-key read, hashed with the path and query."""
+    versions = (await session.exec(select(UserVersion).where(UserVersion.user_id == user.id))).first()
+    counters = [getattr(versions, c) if versions else 0 for c in collections]
+    key = f"{user.id}|{request.url.path}?{request.url.query}|{counters}|{extra}"
+    return '"%s"' % hashlib.sha1(key.encode()).hexdigest()
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """A 304 if the client already holds etag; otherwise tag the outgoing response and return None."""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# --- Adherence rollups ---
+def adherence_row(med_id: int, user_id: int, day: date, scheduled: int = 0, taken: int = 0, late: int = 0) -> dict:
+    return {"medication_id": med_id, "user_id": user_id, "day": day, "scheduled": scheduled,
+            "taken": taken, "late": late, "missed": 0, "closed": False}
+
+def bump_adherence(session: Session, rows: List[dict]):
+    """Add the scheduled/taken/late deltas in rows to the daily rollups; closed days get missed recomputed."""
+    if not rows:
+        return
+    stmt = dialect_insert(session, AdherenceDaily)
+    scheduled = AdherenceDaily.scheduled + stmt.excluded.scheduled
+    taken = AdherenceDaily.taken + stmt.excluded.taken
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["medication_id", "day"],
+        set_={
+            "scheduled": scheduled,
+            "taken": taken,
+            # Never below zero, even if a rollup was seeded without an intake's lateness
+            "late": case((AdherenceDaily.late + stmt.excluded.late < 0, 0), else_=AdherenceDaily.late + stmt.excluded.late),
+            "missed": case(
+                (AdherenceDaily.closed == True, case((scheduled > taken, scheduled - taken), else_=0)),
+                else_=AdherenceDaily.missed
+            ),
+        }
+    )
+    session.exec(stmt, params=rows)
+
+def is_late(scheduled_for: datetime, taken_at: datetime, user: "User") -> bool:
+    # taken_at is server-local (datetime.now()), scheduled_for is the user's local wall clock
+    taken_local = taken_at.astimezone(ZoneInfo(user.timezone or "Asia/Kolkata")).replace(tzinfo=None)
+    return taken_local - scheduled_for > timedelta(minutes=ADHERENCE_LATE_MINUTES)
+
+def taken_adherence_rows(user: "User", changes) -> List[dict]:
+    """Rollup deltas for Taken rows inserted (sign=1) or deleted (sign=-1): [(med_id, scheduled_for, taken_at, sign)]."""
+    rows = {}
+    for med_id, scheduled_for, taken_at, sign in changes:
+        key = (med_id, scheduled_for.date())
+        row = rows.setdefault(key, adherence_row(med_id, user.id, key[1]))
+        row["taken"] += sign
+        if taken_at is not None and is_late(scheduled_for, taken_at, user):
+            row["late"] += sign
+    return list(rows.values())
+
+def close_adherence_days(session: Session):
+    """Close every open rollup whose day has ended in its user's timezone, fixing missed = scheduled - taken."""
+    timezones = session.exec(
+        select(User.timezone).distinct()
+        .join(AdherenceDaily, AdherenceDaily.user_id == User.id)
+        .where(AdherenceDaily.closed == False)
+    ).all()
+    for tz_name in timezones:
+        today = datetime.now(ZoneInfo(tz_name or "Asia/Kolkata")).date()
+        session.exec(
+            update(AdherenceDaily)
+            .where(AdherenceDaily.closed == False, AdherenceDaily.day < today,
+                   AdherenceDaily.user_id.in_(select(User.id).where(User.timezone == tz_name)))
+            .values(closed=True, missed=case(
+                (AdherenceDaily.scheduled > AdherenceDaily.taken, AdherenceDaily.scheduled - AdherenceDaily.taken),
+                else_=0
+            ))
+        )
+    session.commit()
+
+def extend_doses(session: Session, user_id: Optional[int] = None):
+    """
+    Materialize each medication's doses (every user's, or only user_id's) from the day after its last
+    materialized dose, or its start_date if it has none, through today+DOSE_HORIZON_DAYS in its user's
+    timezone. Starting from the last dose rather than today means no day is skipped after a gap.
+    """
+    meds = select(Medication, User.timezone).join(User, User.id == Medication.user_id).options(selectinload(Medication.times))
+    last = select(DoseOccurrence.medication_id, func.max(DoseOccurrence.scheduled_for)).group_by(DoseOccurrence.medication_id)
+    if user_id is not None:
+        meds = meds.where(Medication.user_id == user_id)
+        last = last.where(DoseOccurrence.user_id == user_id)
+    last = dict(session.exec(last).all())
+    for m, tz_name in session.exec(meds).all():
+        horizon = datetime.now(ZoneInfo(tz_name or "Asia/Kolkata")).date() + timedelta(days=DOSE_HORIZON_DAYS)
+        first = last[m.id].date() + timedelta(days=1) if m.id in last else m.start_date
+        if first <= horizon:
+            logger.debug("Materializing doses for medication %s: %s..%s", m.id, first, horizon)
+            materialize_doses(session, m, [t.time for t in m.times], first, horizon)
+
+def backfill_doses(session: Session):
+    """Materialize the days between start_date and the first dose of medications created before doses began at start_date."""
+    first = (
+        select(DoseOccurrence.medication_id, func.min(DoseOccurrence.scheduled_for).label("first_dose"))
+        .group_by(DoseOccurrence.medication_id).subquery()
+    )
+    rows = session.exec(
+        select(Medication, first.c.first_dose).join(first, first.c.medication_id == Medication.id)
+        .where(func.date(first.c.first_dose) > Medication.start_date)
+        .options(selectinload(Medication.times))
+    ).all()
+    for m, first_dose in rows:
+        materialize_doses(session, m, [t.time for t in m.times], m.start_date, first_dose.date() - timedelta(days=1))
+
+def ensure_doses(session: Session, user: "User"):
+    """Extend the user's materialized doses so the horizon always reaches today+DOSE_HORIZON_DAYS."""
+    today = user_today(user)
+    if _doses_through.get(user.id, date.min) > today:
+        return
+    extend_doses(session, user.id)
+    session.commit()
+    _doses_through[user.id] = today + timedelta(days=DOSE_HORIZON_DAYS)
+
+def pending_doses_query(user_ids: List[int], start: datetime, end: datetime):
+    """Untaken doses of user_ids scheduled in [start, end] (naive local): one range scan anti-joined against Taken."""
+    return (
+        select(DoseOccurrence.user_id, DoseOccurrence.medication_id, DoseOccurrence.scheduled_for,
+               Medication.name, Medication.dose)
+        .join(Medication, Medication.id == DoseOccurrence.medication_id)
+        .outerjoin(Taken, and_(Taken.medication_id == DoseOccurrence.medication_id,
+                               Taken.scheduled_for == DoseOccurrence.scheduled_for))
+        .where(DoseOccurrence.user_id.in_(user_ids),
+               DoseOccurrence.scheduled_for >= start,
+               DoseOccurrence.scheduled_for <= end,
+               Taken.id == None)
+        .order_by(DoseOccurrence.scheduled_for)
+    )
+
+def reminder_payload(med_id: int, scheduled_for: datetime, name: str, dose: Optional[str], user_tz: ZoneInfo) -> dict:
+    return {
+        "med_id": med_id,
+        "name": name,
+        "dose": dose,
+        "scheduled_for": scheduled_for.replace(tzinfo=user_tz).isoformat()
+    }
+
 # --- FastAPI app ---
 
+class RouteMetrics:
+    """Per-route latency histograms and DB totals, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets=METRICS_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method: str, route: str, status_code: int, seconds: float, db: RequestDbStats):
+        key = (method, route, str(status_code))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0, "db_queries": 0, "db_seconds": 0.0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series["buckets"][i] += 1
+            series["count"] += 1
+            series["sum"] += seconds
+            series["db_queries"] += db.queries
+            series["db_seconds"] += db.seconds
+
+    def render(self) -> str:
+        def labels(key, **extra):
+            pairs = dict(zip(("method", "route", "status"), key), **extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs.items()) + "}"
+
+        with self._lock:
+            series = sorted((k, dict(v, buckets=list(v["buckets"]))) for k, v in self._series.items())
+        lines = [
+            "# HELP medbuddy_http_request_duration_seconds Request latency by route.",
+            "# TYPE medbuddy_http_request_duration_seconds histogram",
+        ]
+        for key, s in series:
+            for bound, count in zip(self.buckets, s["buckets"]):
+                lines.append(f"medbuddy_http_request_duration_seconds_bucket{labels(key, le=bound)} {count}")
+            lines.append(f'medbuddy_http_request_duration_seconds_bucket{labels(key, le="+Inf")} {s["count"]}')
+            lines.append(f"medbuddy_http_request_duration_seconds_sum{labels(key)} {s['sum']:.6f}")
+            lines.append(f"medbuddy_http_request_duration_seconds_count{labels(key)} {s['count']}")
+        lines += ["# HELP medbuddy_db_queries_total SQL statements issued, by route.", "# TYPE medbuddy_db_queries_total counter"]
+        lines += [f"medbuddy_db_queries_total{labels(key)} {s['db_queries']}" for key, s in series]
+        lines += ["# HELP medbuddy_db_seconds_total Time spent executing SQL, by route.", "# TYPE medbuddy_db_seconds_total counter"]
+        lines += [f"medbuddy_db_seconds_total{labels(key)} {s['db_seconds']:.6f}" for key, s in series]
+        pools = [(name, pool.stats.snapshot(pool)) for name, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool))
+                 if isinstance(pool, _TimedCheckoutMixin)]
+        for metric, field, kind in (("db_pool_checked_out", "checked_out", "gauge"), ("db_pool_overflow", "overflow", "gauge"),
+                                    ("db_pool_checkouts_total", "checkouts", "counter"), ("db_pool_timeouts_total", "timeouts", "counter")):
+            lines.append(f"# TYPE medbuddy_{metric} {kind}")
+            lines += [f'medbuddy_{metric}{{pool="{name}"}} {snapshot[field]}' for name, snapshot in pools]
+        return "\n".join(lines) + "\n"
+
+route_metrics = RouteMetrics()
+
+_REQUEST_ID_RE = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+class RequestMetricsMiddleware:
+    """
+    Times each HTTP request and counts its SQL statements. Adds a Server-Timing header
+    (db;dur, app;dur) to the response, logs one structured line per request and feeds /metrics.
+    Every log record emitted while handling the request carries its request id, taken from a
+    well-formed incoming X-Request-ID or generated, and echoed back in the response.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_id = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"x-request-id"), "")
+        if not _REQUEST_ID_RE.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+        id_token = _request_id.set(request_id)
+        stats = RequestDbStats()
+        token = _request_db_stats.set(stats)
+        started = perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                elapsed = perf_counter() - started
+                timing = f'db;dur={stats.seconds * 1000:.1f};desc="{stats.queries} queries", app;dur={elapsed * 1000:.1f}'
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"server-timing", timing.encode("latin-1")), (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_db_stats.reset(token)
+            elapsed = perf_counter() - started
+            # Label by route template, not raw path, so ids don't blow up the series count
+            route = getattr(scope.get("route"), "path", "unmatched")
+            if METRICS_ENABLED:
+                route_metrics.observe(scope["method"], route, status_code, elapsed, stats)
+            request_logger.info(
+                "%s %s %s %.1fms db=%d/%.1fms", scope["method"], route, status_code, elapsed * 1000, stats.queries, stats.seconds * 1000,
+                extra={"method": scope["method"], "route": route, "path": scope["path"], "status": status_code,
+                       "duration_ms": round(elapsed * 1000, 3), "db_queries": stats.queries, "db_ms": round(stats.seconds * 1000, 3)}
+            )
+            _request_id.reset(id_token)
+
 app = FastAPI()
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESSLEVEL)
+# Outermost, so its timing includes compression and it sees the final response headers
+app.add_middleware(RequestMetricsMiddleware)
 
 
 # Vitals endpoints (must be after get_user_from_token and get_session)
@@ -206,20 +1205,35 @@ def get_session():
     with Session(engine) as session:
         yield session
 
+async def get_async_session():
+    # expire_on_commit=False: handlers read attributes after commit, which would otherwise need a lazy (sync) reload
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
 # Auth helpers
-def authenticate_user(session: Session, email: str, password: str):
-    user = session.exec(select(User).where(User.email == email)).first()
+async def authenticate_user(session: AsyncSession, email: str, password: str):
+    user = (await session.exec(select(User).where(User.email == email))).first()
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await run_password_task(verify_password, password, user.hashed_password):
         return False
+    # Transparently move old hashes to the current scheme / cost factor
+    if pwd_context.needs_update(user.hashed_password):
+        user.hashed_password = await run_password_task(get_password_hash, password)
+        session.add(user)
+        await session.commit()
     return user
 
 from sqlmodel import SQLModel
 
 @app.on_event("startup")
 def on_startup():
-    SQLModel.metadata.create_all(engine)
+    create_db_and_tables()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    if _password_pool is not None:
+        _password_pool.shutdown(wait=False, cancel_futures=True)
 
 @app.get("/debug/db")
 def debug_db():
@@ -232,26 +1246,26 @@ from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 @app.post("/register", response_model=Token)
-def register(user_in: UserCreate, session: Session = Depends(get_session)):
-    existing = session.exec(select(User).where(User.email == user_in.email)).first()
+async def register(user_in: UserCreate, session: AsyncSession = Depends(get_async_session)):
+    existing = (await session.exec(select(User).where(User.email == user_in.email))).first()
     if existing:
         raise HTTPException(status_code=400, detail="User already exists")
-    user = User(email=user_in.email, hashed_password=get_password_hash(user_in.password),timezone = user_in.timezone or "Asia/Kolkata")
+    user = User(email=user_in.email, hashed_password=await run_password_task(get_password_hash, user_in.password),timezone = user_in.timezone or "Asia/Kolkata")
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
     token = create_access_token({"sub": str(user.id)})
     return {"access_token": token, "token_type": "bearer", "email": user.email}
 
 @app.post("/token", response_model=Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
-    user = authenticate_user(session, form_data.username, form_data.password)
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_async_session)):
+    user = await authenticate_user(session, form_data.username, form_data.password)
     if not user:
         raise HTTPException(status_code=401, detail="Incorrect username or password")
     token = create_access_token({"sub": str(user.id)})
     return {"access_token": token, "token_type": "bearer", "email": user.email}
 
-def get_user_from_token(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+async def get_user_from_token(token: str = Depends(oauth2_scheme), session: AsyncSession = Depends(get_async_session)):
     credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials")
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -260,130 +1274,710 @@ def get_user_from_token(token: str = Depends(oauth2_scheme), session: Session =
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = session.get(User, int(user_id))
+    cached = user_cache.get(int(user_id))
+    if cached is not None:
+        return cached
+    user = await session.get(User, int(user_id))
     if user is None:
         raise credentials_exception
-    return user
+    # Cache a detached copy so commits in other requests can't expire its attributes
+    cached = User(id=user.id, email=user.email, hashed_password="", timezone=user.timezone)
+    user_cache.set(user.id, cached)
+    return cached
 
 # Vitals endpoints
 @app.post("/vitals", response_model=VitalsRead)
-def add_vitals(vital: VitalsCreate, user: User = Depends(get_user_from_token), session: Session = Depends(get_session)):
+async def add_vitals(vital: VitalsCreate, user: User = Depends(get_user_from_token), session: AsyncSession = Depends(get_async_session)):
     v = Vitals(
         user_id=user.id,
-        bp=vital.bp,
-        hr=vital.hr,
-        temp=vital.temp,
-        record_time=vital.record_time or datetime.now()
+        record_time=vital.record_time or datetime.now(),
+        **vitals_columns(vital)
     )
     session.add(v)
-    session.commit()
-    session.refresh(v)
-    return VitalsRead(id=v.id, bp=v.bp, hr=v.hr, temp=v.temp, record_time=v.record_time)
+    try:
+        await session.flush()
+    except sa_exc.IntegrityError:
+        raise HTTPException(status_code=409, detail="Vitals already recorded at this time")
+    await session.run_sync(record_changes, user.id, [("vitals", v.id)])
+    try:
+        await session.commit()
+    except sa_exc.IntegrityError:
+        raise HTTPException(status_code=409, detail="Vitals already recorded at this time")
+    return to_vitals_read(v)
 
 @app.get("/vitals", response_model=List[VitalsRead])
-def list_vitals(user: User = Depends(get_user_from_token), session: Session = Depends(get_session)):
-    vitals = session.exec(select(Vitals).where(Vitals.user_id == user.id)).all()
-    return [VitalsRead(id=v.id, bp=v.bp, hr=v.hr, temp=v.temp, record_time=v.record_time) for v in vitals]
-    credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials")
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = session.get(User, int(user_id))
-    if user is None:
-        raise credentials_exception
-    return user
+async def list_vitals(
+    request: Request,
+    response: Response,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=VITALS_PAGE_MAX),
+    cursor: Optional[str] = None,
+    user: User = Depends(get_user_from_token),
+    session: AsyncSession = Depends(get_async_session)
+):
+    etag = await collection_etag(request, session, user, ("vitals",))
+    if (cached := not_modified(request, response, etag)) is not None:
+        return cached
+    # Newest first, walking the (user_id, record_time) index; the next page's cursor goes in X-Next-Cursor
+    q = select(Vitals).where(Vitals.user_id == user.id)
+    if since:
+        q = q.where(Vitals.record_time >= since)
+    if until:
+        q = q.where(Vitals.record_time < until)
+    if cursor:
+        cursor_time, cursor_id = decode_vitals_cursor(cursor)
+        q = q.where(or_(Vitals.record_time < cursor_time,
+                        and_(Vitals.record_time == cursor_time, Vitals.id < cursor_id)))
+    q = q.order_by(Vitals.record_time.desc(), Vitals.id.desc()).limit(limit + 1)
+    vitals = (await session.exec(q)).all()
+    if len(vitals) > limit:
+        vitals = vitals[:limit]
+        response.headers["X-Next-Cursor"] = encode_vitals_cursor(vitals[-1])
+    return [to_vitals_read(v) for v in vitals]
+
+
+def vitals_bucket_expr(dialect_name: str, bucket: str):
+    """SQL expression truncating Vitals.record_time to the start of its hour/day/week (weeks start on Monday)."""
+    if dialect_name == "postgresql":
+        return func.date_trunc(bucket, Vitals.record_time)
+    if bucket == "hour":
+        return func.strftime("%Y-%m-%d %H:00:00", Vitals.record_time)
+    if bucket == "day":
+        return func.date(Vitals.record_time)
+    return func.date(Vitals.record_time, "weekday 0", "-6 days")
+
+_EPOCH = datetime(1970, 1, 1)
+
+def vitals_epoch_expr(dialect_name: str):
+    """Vitals.record_time as seconds since 1970-01-01, reading the naive timestamp as if it were UTC."""
+    if dialect_name == "postgresql":
+        return func.date_part("epoch", Vitals.record_time)
+    return (func.julianday(Vitals.record_time) - 2440587.5) * 86400.0
+
+def _round(value, digits=2):
+    return round(value, digits) if value is not None else None
+
+@app.get("/vitals/summary")
+async def vitals_summary(
+    bucket: str = Query("day", pattern="^(hour|day|week)$"),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user: User = Depends(get_user_from_token),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """min/max/mean/last of every typed metric per bucket, aggregated in a single SQL query."""
+    until = until or datetime.now()
+    since = since or until - VITALS_SUMMARY_DEFAULT_RANGE[bucket]
+    bucket_expr = vitals_bucket_expr(session.get_bind().dialect.name, bucket)
+    metric_cols = [getattr(Vitals, m) for m in VITALS_METRICS]
+    # last_<metric>: latest non-null value within the bucket
+    readings = select(
+        bucket_expr.label("bucket"),
+        *metric_cols,
+        *[
+            func.first_value(col).over(partition_by=bucket_expr, order_by=(col.is_(None), Vitals.record_time.desc()))
+            .label(f"last_{col.key}")
+            for col in metric_cols
+        ]
+    ).where(Vitals.user_id == user.id, Vitals.record_time >= since, Vitals.record_time < until).subquery()
+    aggregates = []
+    for m in VITALS_METRICS:
+        col = readings.c[m]
+        aggregates += [func.min(col), func.max(col), func.avg(col), func.count(col), func.max(readings.c[f"last_{m}"])]
+    rows = (await session.exec(
+        select(readings.c.bucket, func.count(), *aggregates).group_by(readings.c.bucket).order_by(readings.c.bucket)
+    )).all()
+
+    result = []
+    for row in rows:
+        bucket_start = row[0] if isinstance(row[0], datetime) else datetime.fromisoformat(str(row[0]))
+        entry = {"bucket_start": bucket_start.isoformat(), "count": row[1]}
+        for i, m in enumerate(VITALS_METRICS):
+            mn, mx, mean, count, last = row[2 + i * 5: 7 + i * 5]
+            entry[m] = {"min": mn, "max": mx, "mean": _round(mean), "last": last, "count": count}
+        result.append(entry)
+    return result
+
+def lttb(points: list, threshold: int) -> list:
+    """Largest-Triangle-Three-Buckets downsampling of (x, y, ...) tuples sorted by x."""
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return points
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        span = avg_end - avg_start
+        avg_x = sum(points[j][0] for j in range(avg_start, avg_end)) / span
+        avg_y = sum(points[j][1] for j in range(avg_start, avg_end)) / span
+        ax, ay = points[a][0], points[a][1]
+        max_area, next_a = -1.0, int(i * every) + 1
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs((ax - avg_x) * (points[j][1] - ay) - (ax - points[j][0]) * (avg_y - ay))
+            if area > max_area:
+                max_area, next_a = area, j
+        sampled.append(points[next_a])
+        a = next_a
+    sampled.append(points[-1])
+    return sampled
+
+@app.get("/vitals/series")
+async def vitals_series(
+    metric: str = Query(..., pattern="^(systolic|diastolic|heart_rate|temperature_c)$"),
+    points: int = Query(300, ge=3, le=5000),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    user: User = Depends(get_user_from_token),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    One metric over time (default: the last VITALS_SERIES_DEFAULT_RANGE), LTTB-downsampled to at most `points`
+    points for charting. Dense ranges are first averaged into VITALS_SERIES_SQL_BUCKETS equal time buckets
+    in SQL, so neither the result set nor the Python downsampling grows with the number of readings.
+    """
+    until = until or datetime.now()
+    since = since or until - VITALS_SERIES_DEFAULT_RANGE
+    col = getattr(Vitals, metric)
+    in_range = (Vitals.user_id == user.id, col != None, Vitals.record_time >= since, Vitals.record_time < until)
+    total = (await session.exec(select(func.count()).select_from(Vitals).where(*in_range))).one()
+    if total <= VITALS_SERIES_SQL_BUCKETS:
+        rows = (await session.exec(select(Vitals.record_time, col).where(*in_range).order_by(Vitals.record_time))).all()
+        readings = [((t - _EPOCH).total_seconds(), v) for t, v in rows]
+    else:
+        dialect_name = session.get_bind().dialect.name
+        epoch = vitals_epoch_expr(dialect_name)
+        offset = (epoch - (since - _EPOCH).total_seconds()) / ((until - since).total_seconds() / VITALS_SERIES_SQL_BUCKETS)
+        # Readings are never before `since`, so truncation is floor (Postgres would round a plain cast)
+        bucket = func.floor(offset) if dialect_name == "postgresql" else cast(offset, Integer)
+        bucketed = select(bucket.label("bucket"), epoch.label("x"), col.label("v")).where(*in_range).subquery()
+        rows = (await session.exec(
+            select(func.avg(bucketed.c.x), func.avg(bucketed.c.v)).group_by(bucketed.c.bucket).order_by(bucketed.c.bucket)
+        )).all()
+        readings = [(round(float(x), 3), _round(float(v))) for x, v in rows]
+    series = lttb(readings, points)
+    return {
+        "metric": metric,
+        "total": total,
+        "points": [{"t": (_EPOCH + timedelta(seconds=x)).isoformat(), "v": v} for x, v in series]
+    }
 
+class VitalsIngest:
+    """
+    Buffers validated readings and writes them VITALS_BULK_CHUNK at a time, skipping (user_id, record_time)
+    duplicates. Each chunk commits with its change-log entries, so no transaction (or SQLite write lock) stays
+    open while the rest of the body streams in, and memory stays bounded by one chunk. Chunks committed
+    before an upload breaks off are kept; resending the whole upload is safe.
+    """
+
+    def __init__(self, session: AsyncSession, user_id: int):
+        self.session = session
+        self.user_id = user_id
+        self.rows = []
+        self.received = 0
+        self.accepted = 0
+        self.inserted = 0
+        self.errors = []
+
+    async def add(self, item):
+        self.received += 1
+        try:
+            vital = VitalsCreate.model_validate(item)
+        except ValidationError as e:
+            self._reject(e.errors(include_url=False, include_context=False))
+            return
+        if vital.record_time is None:
+            self._reject("record_time is required for bulk ingestion")
+            return
+        self.rows.append({"user_id": self.user_id, "record_time": vital.record_time, **vitals_columns(vital)})
+        self.accepted += 1
+        if len(self.rows) >= VITALS_BULK_CHUNK:
+            await self.flush()
+
+    async def add_line(self, line: bytes):
+        try:
+            item = json.loads(line)
+        except ValueError:
+            self.received += 1
+            self._reject("invalid JSON")
+            return
+        await self.add(item)
+
+    def _reject(self, error):
+        if len(self.errors) < 100:
+            self.errors.append({"index": self.received - 1, "error": error})
+
+    async def flush(self):
+        if not self.rows:
+            return
+        result = await self.session.exec(
+            dialect_insert(self.session, Vitals)
+            .on_conflict_do_nothing(index_elements=["user_id", "record_time"])
+            .returning(Vitals.id),
+            params=self.rows
+        )
+        inserted_ids = result.scalars().all()
+        await self.session.run_sync(record_changes, self.user_id, [("vitals", i) for i in inserted_ids])
+        await self.session.commit()
+        self.inserted += len(inserted_ids)
+        self.rows = []
+
+    def summary(self) -> dict:
+        rejected = self.received - self.accepted
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "duplicates": self.accepted - self.inserted,
+            "rejected": rejected,
+            "errors": self.errors,
+        }
+
+async def iter_ndjson(request: Request):
+    """Yield decoded objects from an NDJSON body as it streams in, one line at a time."""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+        if len(buffer) > 64 * 1024:
+            raise HTTPException(status_code=413, detail="NDJSON line too long")
+    if buffer.strip():
+        yield buffer
+
+@app.post("/vitals/bulk")
+async def bulk_add_vitals(request: Request, user: User = Depends(get_user_from_token), session: AsyncSession = Depends(get_async_session)):
+    """Ingest many readings: a JSON array, or an NDJSON stream (Content-Type: application/x-ndjson) of any length."""
+    ingest = VitalsIngest(session, user.id)
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        async for line in iter_ndjson(request):
+            await ingest.add_line(line)
+    else:
+        body = b""
+        async for chunk in request.stream():
+            body += chunk
+            if len(body) > VITALS_BULK_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="Body too large; stream it as NDJSON instead")
+        try:
+            items = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array")
+        for item in items:
+            await ingest.add(item)
+    await ingest.flush()
+    return ingest.summary()
+
+
+async def med_by_idempotency_key(session: AsyncSession, user_id: int, key: str) -> Optional[Medication]:
+    return (await session.exec(
+        select(Medication).where(Medication.user_id == user_id, Medication.idempotency_key == key)
+    )).first()
 
 @app.post("/meds")
-def create_med(med: MedCreate, user: User = Depends(get_user_from_token), session: Session = Depends(get_session)):
-    times_joined = ",".join(med.times)
+async def create_med(
+    med: MedCreate,
+    user: User = Depends(get_user_from_token),
+    session: AsyncSession = Depends(get_async_session),
+    idempotency_key: Optional[str] = Header(None, max_length=64),
+):
+    """Create a medication; a retry sending an Idempotency-Key already used by this user gets the row it created."""
+    if idempotency_key and (existing := await med_by_idempotency_key(session, user.id, idempotency_key)):
+        return {"id": existing.id, "name": existing.name}
     start = med.start_date if med.start_date else date.today()
     # Convert list of time strings (e.g. ["08:00", "20:00"]) to MedicationTime objects
     med_time_objects = [MedicationTime(time=datetime.strptime(t, "%H:%M").time()) for t in med.times]
-    dose = int(med.dose) if isinstance(med.dose, str) else med.dose
-    new = Medication(user_id=user.id, name=med.name, dose=med.dose, times=med_time_objects, start_date=start, end_date=med.end_date, quantity=med.quantity)
+    new = Medication(user_id=user.id, name=med.name, dose=med.dose, times=med_time_objects, start_date=start, end_date=med.end_date,
+                     quantity=med.quantity, idempotency_key=idempotency_key)
     session.add(new)
-    session.commit()
-    session.refresh(new)
+    try:
+        await session.flush()
+    except sa_exc.IntegrityError:
+        if not idempotency_key:
+            raise
+        # A concurrent retry with the same key got there first
+        await session.rollback()
+        existing = await med_by_idempotency_key(session, user.id, idempotency_key)
+        return {"id": existing.id, "name": existing.name}
+    today = user_today(user)
+    await session.run_sync(materialize_doses, new, [t.time for t in med_time_objects], start, today + timedelta(days=DOSE_HORIZON_DAYS))
+    await session.run_sync(record_changes, user.id, [("medication", new.id)] + [("medication_time", t.id) for t in med_time_objects])
+    await session.commit()
+    reminder_scheduler.add_medication(new, [t.time for t in med_time_objects], user.timezone)
     return {"id": new.id, "name": new.name}
 
 @app.get("/meds")
-def list_meds(user: User = Depends(get_user_from_token), session: Session = Depends(get_session)):
-    meds = session.exec(select(Medication).where(Medication.user_id == user.id)).all()
-    result = []
-    for m in meds:
-        # Count how many times this medication has been taken
-        stmt = select(func.count()).where(Taken.medication_id == m.id)
-        taken_count_result = session.execute(stmt)
-        taken_count = taken_count_result.scalar()  # scalar() gives the integer
+async def list_meds(request: Request, response: Response, user: User = Depends(get_user_from_token), session: AsyncSession = Depends(get_async_session)):
+    # quantity_left depends on taken_count, so Taken writes change this representation too
+    etag = await collection_etag(request, session, user, ("meds", "taken"))
+    if (cached := not_modified(request, response, etag)) is not None:
+        return cached
+    # Times are eager loaded in one extra query; taken_count avoids scanning Taken altogether
+    meds = (await session.exec(
+        select(Medication).where(Medication.user_id == user.id)
+        .options(selectinload(Medication.times)).order_by(Medication.id)
+    )).all()
+    return [med_payload(m) for m in meds]
+
+def med_payload(m: Medication) -> dict:
+    return {
+        "id": m.id,
+        "name": m.name,
+        "dose": m.dose,
         # Convert MedicationTime objects to HH:MM strings
-        times_str = [t.time.strftime("%H:%M") for t in m.times]
-        result.append({
-            "id": m.id,
-            "name": m.name,
-            "dose": m.dose,
-            "times": times_str,
-            "start_date": m.start_date,
-            "end_date": m.end_date,
-            "quantity": m.quantity,
-            "quantity_left": (m.quantity - taken_count) if m.quantity is not None else None
-        })
-    return result
+        "times": [t.time.strftime("%H:%M") for t in m.times],
+        "start_date": m.start_date,
+        "end_date": m.end_date,
+        "quantity": m.quantity,
+        "quantity_left": (m.quantity - m.taken_count) if m.quantity is not None else None
+    }
 
 # ----------------------------
 # GET REMINDERS
 # ----------------------------
 @app.get("/reminders")
-def get_reminders(
-    minutes_before: int = 15,
-    minutes_after: int = 5,
+async def get_reminders(
+    request: Request,
+    response: Response,
+    minutes_before: int = REMINDER_GRACE_MINUTES,
+    minutes_after: int = REMINDER_LEAD_MINUTES,
     user: User = Depends(get_user_from_token),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     user_tz = ZoneInfo(user.timezone or "Asia/Kolkata")
-    now = datetime.now(user_tz)
+    now = datetime.now(user_tz).replace(tzinfo=None)
     start_window = now - timedelta(minutes=minutes_before)
     end_window = now + timedelta(minutes=minutes_after)
 
-    meds = session.exec(select(Medication).where(Medication.user_id == user.id)).all()
-    reminders = []
-
-    for m in meds:
-        # Skip if medication is not active
-        if m.start_date and date.today() < m.start_date:
-            continue
-        if m.end_date and date.today() > m.end_date:
-            continue
-        print("Processing medication:", m.name)  # Debug line
-        print("before for loop")
-        for t in m.times:
-          #  scheduled_time = datetime.combine(date.today(), t.time)
-            #Make scheduled_time timezone-aware
-            scheduled_time = datetime.combine(now.date(), t.time).replace(tzinfo=user_tz)
-            print("Scheduled time:", scheduled_time, type(scheduled_time))  # Debug line
-            print(start_window, end_window)  # Debug line
-            # Check if scheduled_time is within the reminder window
-            if start_window <= scheduled_time <= end_window:
-                # Check if already taken
-                taken = session.exec(
-                    select(Taken)
-                    .where(Taken.medication_id == m.id )#, Taken.scheduled_for == scheduled_time)
-                ).first()
-                print(taken)
-                if not taken:
-                    reminders.append({
-                        "med_id": m.id,
-                        "name": m.name,
-                        "dose": m.dose,
-                        "scheduled_for": scheduled_time.isoformat()
-                    })
+    await session.run_sync(ensure_doses, user)
+    # Doses sit on whole minutes, so the window's contents only change with the minute or a write
+    etag = await collection_etag(request, session, user, ("meds", "taken"), now.strftime("%Y-%m-%dT%H:%M"))
+    if (cached := not_modified(request, response, etag)) is not None:
+        return cached
+    # Single range scan over the (user_id, scheduled_for) index, anti-joined against Taken
+    rows = (await session.exec(pending_doses_query([user.id], start_window, end_window))).all()
+    reminders = [
+        reminder_payload(med_id, scheduled_for, name, dose, user_tz)
+        for _, med_id, scheduled_for, name, dose in rows
+    ]
+    reminder_logger.debug("Reminder window %s..%s for user %s: %d pending", start_window, end_window, user.id, len(reminders))
 
     return reminders
 
+# ----------------------------
+# PUSHED REMINDERS (Server-Sent Events; GET /reminders stays as the polling fallback)
+# ----------------------------
+class ReminderHub:
+    """Fans reminder events out to the open /reminders/stream connections of each user."""
+
+    def __init__(self):
+        self._subscribers = {}
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=100)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def user_ids(self) -> List[int]:
+        return list(self._subscribers)
+
+    def publish(self, user_id: int, event: dict):
+        for queue in self._subscribers.get(user_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass  # a stalled client re-syncs from the snapshot on reconnect
+
+reminder_hub = ReminderHub()
+
+UTC = ZoneInfo("UTC")
+
+class ScheduledDose:
+    """One MedicationTime as the scheduler sees it; cancelled entries are skipped lazily when popped."""
+    __slots__ = ("medication_id", "user_id", "name", "dose", "time", "tz", "start_date", "end_date", "cancelled")
+
+    def __init__(self, med: "Medication", t: time, tz_name: Optional[str]):
+        self.medication_id = med.id
+        self.user_id = med.user_id
+        self.name = med.name
+        self.dose = med.dose
+        self.time = t
+        self.tz = ZoneInfo(tz_name or "Asia/Kolkata")
+        self.start_date = med.start_date
+        self.end_date = med.end_date
+        self.cancelled = False
+
+    def next_fire(self, after_utc: datetime):
+        """(fire instant UTC, scheduled local naive) of the first reminder firing after after_utc, or None once expired.
+
+        Local wall-clock times are resolved through ZoneInfo each day, so DST shifts move the UTC instant;
+        a time skipped by a spring-forward gap resolves with the pre-transition offset.
+        """
+        lead = timedelta(minutes=REMINDER_LEAD_MINUTES)
+        day = (after_utc + lead).replace(tzinfo=UTC).astimezone(self.tz).date() - timedelta(days=1)
+        day = max(day, self.start_date)
+        for _ in range(3):
+            if self.end_date and day > self.end_date:
+                return None
+            scheduled = datetime.combine(day, self.time)
+            fire = scheduled.replace(tzinfo=self.tz).astimezone(UTC).replace(tzinfo=None) - lead
+            if fire > after_utc:
+                return fire, scheduled
+            day += timedelta(days=1)
+        return None
+
+
+class ReminderScheduler:
+    """Min-heap of every active MedicationTime keyed by its next reminder instant in UTC.
+
+    Built at startup, then kept current by create_med/delete_medication; popping a due dose
+    re-pushes its next occurrence, so each fire costs O(log n). The heap is per process: with several
+    workers, writes handled by another worker only show up when the heap is rebuilt: every
+    REMINDER_REFRESH_SECONDS the dispatcher compares the summed UserVersion.meds counters with the
+    value seen at the last load and, only when they differ, runs load() again, which is a full scan of
+    Medication and MedicationTime in every worker. publish_due_reminders re-checks every fired dose
+    against the database so a medication deleted elsewhere is never pushed.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._by_med = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+        self._loading = False
+        self._changed_during_load = []  # (med_id, entries or None for a removal) seen while load() ran
+        self.version: Optional[int] = None  # sum of UserVersion.meds the heap was last built from
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        # Writers may run in the threadpool (sync endpoints), so wake the dispatcher thread-safely
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._changed.set)
+
+    def _push(self, entry: ScheduledDose, after_utc: datetime):
+        nxt = entry.next_fire(after_utc)
+        if nxt is None:
+            entries = self._by_med.get(entry.medication_id)
+            if entries and entry in entries:
+                entries.remove(entry)
+            return
+        heapq.heappush(self._heap, (nxt[0], next(self._seq), nxt[1], entry))
+
+    def load(self, session: Session):
+        """(Re)build the heap from every active MedicationTime, replacing whatever it held.
+
+        Medications added or removed on this worker while the query runs may be missing from (or still
+        in) its snapshot, so those changes are replayed onto the new heap before it is swapped in.
+        """
+        with self._lock:
+            self._loading = True
+            self._changed_during_load = []
+        try:
+            meds = session.exec(
+                select(Medication, User.timezone)
+                .join(User, User.id == Medication.user_id)
+                .where(or_(Medication.end_date == None, Medication.end_date >= date.today() - timedelta(days=1)))
+                .options(selectinload(Medication.times))
+            ).all()
+            now = datetime.utcnow()
+            heap, by_med = [], {}
+            for med, tz_name in meds:
+                for t in med.times:
+                    entry = ScheduledDose(med, t.time, tz_name)
+                    by_med.setdefault(med.id, []).append(entry)
+                    nxt = entry.next_fire(now)
+                    if nxt is not None:
+                        heap.append((nxt[0], next(self._seq), nxt[1], entry))
+            heapq.heapify(heap)
+            with self._lock:
+                for med_id, entries in self._changed_during_load:
+                    if entries is None:
+                        for entry in by_med.pop(med_id, []):
+                            entry.cancelled = True
+                    elif med_id not in by_med:
+                        # Committed after the snapshot was read: carry the entries over
+                        by_med[med_id] = list(entries)
+                        for entry in entries:
+                            nxt = entry.next_fire(now)
+                            if nxt is not None:
+                                heapq.heappush(heap, (nxt[0], next(self._seq), nxt[1], entry))
+                self._heap, self._by_med = heap, by_med
+        finally:
+            with self._lock:
+                self._loading = False
+                self._changed_during_load = []
+        self._notify()
+
+    def add_medication(self, med: "Medication", times: List[time], tz_name: Optional[str], notify: bool = True):
+        now = datetime.utcnow()
+        with self._lock:
+            entries = [ScheduledDose(med, t, tz_name) for t in times]
+            self._by_med.setdefault(med.id, []).extend(entries)
+            for entry in entries:
+                self._push(entry, now)
+            if self._loading:
+                self._changed_during_load.append((med.id, entries))
+        if notify:
+            self._notify()
+
+    def remove_medication(self, med_id: int):
+        with self._lock:
+            for entry in self._by_med.pop(med_id, []):
+                entry.cancelled = True
+            if self._loading:
+                self._changed_during_load.append((med_id, None))
+
+    def pop_due(self, now_utc: datetime):
+        """Pop every dose whose reminder is due, rescheduling each for its next occurrence."""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now_utc:
+                fire, _, scheduled, entry = heapq.heappop(self._heap)
+                if entry.cancelled:
+                    continue
+                due.append((entry, scheduled))
+                self._push(entry, fire)
+        reminder_logger.debug("%d reminder(s) due at %s", len(due), now_utc)
+        return due
+
+    def seconds_until_next(self, now_utc: datetime) -> Optional[float]:
+        with self._lock:
+            while self._heap and self._heap[0][3].cancelled:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            return max((self._heap[0][0] - now_utc).total_seconds(), 0.0)
+
+    async def wait(self, timeout: Optional[float]):
+        self._changed.clear()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+reminder_scheduler = ReminderScheduler()
+
+async def publish_due_reminders(due):
+    """Push fired doses that are still scheduled and untaken to the users with an open stream."""
+    due = [(entry, scheduled) for entry, scheduled in due if entry.user_id in reminder_hub.user_ids()]
+    if not due:
+        return
+    keys = [(entry.medication_id, scheduled) for entry, scheduled in due]
+    # The heap may be stale (the medication deleted or changed through another worker), so only doses
+    # still materialized for an existing medication are pushed, with the medication's current name/dose
+    async with AsyncSession(async_engine) as session:
+        pending = {(med_id, scheduled_for): (name, dose) for med_id, scheduled_for, name, dose in (await session.exec(
+            select(DoseOccurrence.medication_id, DoseOccurrence.scheduled_for, Medication.name, Medication.dose)
+            .join(Medication, Medication.id == DoseOccurrence.medication_id)
+            .outerjoin(Taken, and_(Taken.medication_id == DoseOccurrence.medication_id,
+                                   Taken.scheduled_for == DoseOccurrence.scheduled_for))
+            .where(tuple_(DoseOccurrence.medication_id, DoseOccurrence.scheduled_for).in_(keys), Taken.id == None)
+        )).all()}
+    for entry, scheduled in due:
+        if (entry.medication_id, scheduled) in pending:
+            name, dose = pending[(entry.medication_id, scheduled)]
+            reminder_logger.debug("Pushing reminder: user %s, medication %s at %s", entry.user_id, entry.medication_id, scheduled)
+            reminder_hub.publish(entry.user_id, reminder_payload(entry.medication_id, scheduled, name, dose, entry.tz))
+
+async def refresh_reminder_schedule():
+    """Rebuild the heap if any medication changed since it was last built, through any worker."""
+    async with AsyncSession(async_engine) as session:
+        # One cheap aggregate instead of the full Medication/MedicationTime scan load() does
+        version = (await session.exec(select(func.coalesce(func.sum(UserVersion.meds), 0)))).one()
+        if version == reminder_scheduler.version:
+            return
+        await session.run_sync(reminder_scheduler.load)
+        reminder_scheduler.version = version
+
+async def reminder_dispatch_loop():
+    checked = monotonic()
+    while True:
+        delay = reminder_scheduler.seconds_until_next(datetime.utcnow())
+        if REMINDER_REFRESH_SECONDS > 0:
+            until_check = max(REMINDER_REFRESH_SECONDS - (monotonic() - checked), 0)
+            delay = until_check if delay is None else min(delay, until_check)
+        # Sleep until the next fire instant or change check, or until a medication is added/removed
+        await reminder_scheduler.wait(delay)
+        if REMINDER_REFRESH_SECONDS > 0 and monotonic() - checked >= REMINDER_REFRESH_SECONDS:
+            checked = monotonic()
+            try:
+                await refresh_reminder_schedule()
+            except Exception:
+                reminder_logger.exception("Reloading the reminder schedule failed")
+        due = reminder_scheduler.pop_due(datetime.utcnow())
+        try:
+            await publish_due_reminders(due)
+        except Exception:
+            reminder_logger.exception("Reminder dispatch failed")
+
+_reminder_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_reminder_dispatch():
+    global _reminder_task
+    reminder_scheduler.bind_loop(asyncio.get_running_loop())
+    await refresh_reminder_schedule()
+    _reminder_task = asyncio.create_task(reminder_dispatch_loop())
+
+@app.on_event("shutdown")
+async def stop_reminder_dispatch():
+    if _reminder_task is not None:
+        _reminder_task.cancel()
+
+def sse_event(name: str, data) -> str:
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/reminders/stream")
+async def stream_reminders(user: User = Depends(get_user_from_token)):
+    """Server-Sent Events: a `reminders` snapshot on connect, then one `reminder` event per dose entering its window."""
+    user_tz = ZoneInfo(user.timezone or "Asia/Kolkata")
+    now = datetime.now(user_tz).replace(tzinfo=None)
+    # Subscribe before taking the snapshot, so a dose firing in between is pushed rather than lost
+    queue = reminder_hub.subscribe(user.id)
+    try:
+        async with AsyncSession(async_engine) as session:
+            await session.run_sync(ensure_doses, user)
+            rows = (await session.exec(pending_doses_query(
+                [user.id], now - timedelta(minutes=REMINDER_GRACE_MINUTES), now + timedelta(minutes=REMINDER_LEAD_MINUTES)
+            ))).all()
+    except BaseException:
+        reminder_hub.unsubscribe(user.id, queue)
+        raise
+    snapshot = [reminder_payload(med_id, scheduled_for, name, dose, user_tz) for _, med_id, scheduled_for, name, dose in rows]
+
+    async def events():
+        try:
+            yield sse_event("reminders", snapshot)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_event("reminder", event)
+        finally:
+            reminder_hub.unsubscribe(user.id, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 # @app.post("/meds/{med_id}/take")
 # def mark_taken(med_id: int, scheduled_for: Optional[datetime] = None, user: User = Depends(get_user_from_token), session: Session = Depends(get_session)):
 #     med = session.get(Medication, med_id)
@@ -411,81 +2005,98 @@ from typing import Optional
 class TakeRequest(BaseModel):
     scheduled_for: Optional[datetime] = None
 
+class BatchTakeOp(BaseModel):
+    med_id: int
+    scheduled_for: datetime
+    taken: bool = True  # False unmarks the dose
+
+class BatchTakeRequest(BaseModel):
+    operations: List[BatchTakeOp]
+
 
 # ----------------------------
 # Mark as Taken
 # ----------------------------
 @app.post("/meds/{med_id}/take")
-def mark_taken(
+async def mark_taken(
     med_id: int,
     req: TakeRequest,
     user: User = Depends(get_user_from_token),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
-    med = session.get(Medication, med_id)
+    med = await session.get(Medication, med_id)
     if not med or med.user_id != user.id:
         raise HTTPException(status_code=404, detail="Medication not found")
 
-    # If scheduled_for is not provided, use current datetime
-    scheduled_for = req.scheduled_for or datetime.now()
+    # If scheduled_for is not provided, use the current time in the user's timezone
+    scheduled_for = req.scheduled_for or datetime.now(ZoneInfo(user.timezone or "Asia/Kolkata"))
 
-    # Round microseconds to avoid matching issues
-    scheduled_for = scheduled_for.replace(microsecond=0)
+    # Round microseconds and drop any offset so it lines up with the dose occurrences
+    scheduled_for = to_local_naive(scheduled_for, user)
 
-    # Check if already marked
-    existing = session.exec(
-        select(Taken)
-        .where(Taken.medication_id == med_id, Taken.scheduled_for == scheduled_for)
-    ).first()
+    # Insert in one round-trip; the unique index turns a repeat into a no-op
+    taken_at = datetime.now()
+    taken_id = (await session.exec(
+        dialect_insert(session, Taken)
+        .values(medication_id=med_id, scheduled_for=scheduled_for, taken_at=taken_at)
+        .on_conflict_do_nothing(index_elements=["medication_id", "scheduled_for"])
+        .returning(Taken.id)
+    )).scalar()
 
-    if existing:
-        return {"status": "already_marked", "taken_id": existing.id}
+    if taken_id is None:
+        existing = (await session.exec(
+            select(Taken.id)
+            .where(Taken.medication_id == med_id, Taken.scheduled_for == scheduled_for)
+        )).first()
+        return {"status": "already_marked", "taken_id": existing}
 
-    taken = Taken(
-        medication_id=med_id,
-        scheduled_for=scheduled_for,
-        taken_at=datetime.now()
-    )
-    session.add(taken)
-    session.commit()
-    session.refresh(taken)
-    return {"status": "ok", "taken_id": taken.id}
+    await session.exec(update(Medication).where(Medication.id == med_id).values(taken_count=Medication.taken_count + 1))
+    await session.run_sync(bump_adherence, taken_adherence_rows(user, [(med_id, scheduled_for, taken_at, 1)]))
+    await session.run_sync(record_changes, user.id, [("taken", taken_id), ("medication", med_id)])
+    await session.commit()
+    return {"status": "ok", "taken_id": taken_id}
 
 
 # ----------------------------
 # Unmark as Taken
 # ----------------------------
 @app.delete("/meds/{med_id}/take")
-def unmark_taken(
+async def unmark_taken(
     med_id: int,
   #  req: TakeRequest,
     scheduled_for: datetime = Query(...),  # <--- accept from query instead of body
     user: User = Depends(get_user_from_token),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
-    med = session.get(Medication, med_id)
+    med = await session.get(Medication, med_id)
     if not med or med.user_id != user.id:
         raise HTTPException(status_code=404, detail="Medication not found")
 
     # if not req.scheduled_for:
     #     raise HTTPException(status_code=400, detail="scheduled_for is required")
 
-    scheduled_for = scheduled_for.replace(microsecond=0)
+    scheduled_for = to_local_naive(scheduled_for, user)
 
-    taken = session.exec(
-        select(Taken)
+    removed = (await session.exec(
+        delete(Taken)
         .where(Taken.medication_id == med_id, Taken.scheduled_for == scheduled_for)
-    ).first()
+        .returning(Taken.id, Taken.taken_at)
+    )).first()
 
-    if not taken:
+    if not removed:
         raise HTTPException(status_code=404, detail="Taken record not found")
 
-    session.delete(taken)
-    session.commit()
+    await session.exec(update(Medication).where(Medication.id == med_id).values(taken_count=Medication.taken_count - 1))
+    await session.run_sync(bump_adherence, taken_adherence_rows(user, [(med_id, scheduled_for, removed.taken_at, -1)]))
+    await session.run_sync(record_changes, user.id, [("medication", med_id)], [("taken", removed.id)])
+    await session.commit()
     return {"status": "unmarked"}
 
 @app.get("/taken")
-def list_taken(date_str: Optional[str] = Query(None), user: User = Depends(get_user_from_token), session: Session = Depends(get_session)):
+async def list_taken(request: Request, response: Response, date_str: Optional[str] = Query(None), user: User = Depends(get_user_from_token), session: AsyncSession = Depends(get_async_session)):
+    etag = await collection_etag(request, session, user, ("taken",))
+    if (cached := not_modified(request, response, etag)) is not None:
+        return cached
     q = select(Taken, Medication).where(Taken.medication_id == Medication.id, Medication.user_id == user.id)
     if date_str:
         try:
@@ -495,7 +2106,7 @@ def list_taken(date_str: Optional[str] = Query(None), user: User = Depends(get_u
         start = datetime.combine(d, time.min)
         end = datetime.combine(d, time.max)
         q = q.where(Taken.scheduled_for >= start, Taken.scheduled_for <= end)
-    results = session.exec(q).all()
+    results = (await session.exec(q.order_by(Taken.scheduled_for, Taken.medication_id))).all()
     return [
         {
             "med_id": med.id,
@@ -505,10 +2116,241 @@ def list_taken(date_str: Optional[str] = Query(None), user: User = Depends(get_u
         for taken, med in results
     ]
 
+# ----------------------------
+# Mark / Unmark many doses at once
+# ----------------------------
+@app.post("/taken/batch")
+async def batch_taken(
+    req: BatchTakeRequest,
+    user: User = Depends(get_user_from_token),
+    session: AsyncSession = Depends(get_async_session)
+):
+    if len(req.operations) > TAKEN_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {TAKEN_BATCH_MAX} operations per batch")
+
+    ops = [(op.med_id, to_local_naive(op.scheduled_for, user), op.taken) for op in req.operations]
+    # Ownership of every referenced medication in one query
+    med_ids = {med_id for med_id, _, _ in ops}
+    owned = set((await session.exec(
+        select(Medication.id).where(Medication.id.in_(med_ids), Medication.user_id == user.id)
+    )).all()) if med_ids else set()
+
+    # The last operation on a dose wins; earlier ones are reported as superseded
+    final = {}
+    for i, (med_id, scheduled_for, taken) in enumerate(ops):
+        if med_id in owned:
+            final[(med_id, scheduled_for)] = (i, taken)
+    to_take = [key for key, (_, taken) in final.items() if taken]
+    to_untake = [key for key, (_, taken) in final.items() if not taken]
+
+    # (med_id, scheduled_for) -> Taken.id inserted; -> (Taken.id, taken_at) deleted
+    inserted, deleted = {}, {}
+    now = datetime.now()
+    if to_take:
+        inserted = {(m, sf): taken_id for taken_id, m, sf in (await session.exec(
+            dialect_insert(session, Taken)
+            .on_conflict_do_nothing(index_elements=["medication_id", "scheduled_for"])
+            .returning(Taken.id, Taken.medication_id, Taken.scheduled_for),
+            params=[{"medication_id": m, "scheduled_for": sf, "taken_at": now} for m, sf in to_take]
+        )).all()}
+    if to_untake:
+        deleted = {(m, sf): (taken_id, taken_at) for taken_id, m, sf, taken_at in (await session.exec(
+            delete(Taken)
+            .where(tuple_(Taken.medication_id, Taken.scheduled_for).in_(to_untake))
+            .returning(Taken.id, Taken.medication_id, Taken.scheduled_for, Taken.taken_at)
+        )).all()}
+
+    deltas = {}
+    for med_id, _ in inserted:
+        deltas[med_id] = deltas.get(med_id, 0) + 1
+    for med_id, _ in deleted:
+        deltas[med_id] = deltas.get(med_id, 0) - 1
+    deltas = {med_id: d for med_id, d in deltas.items() if d}
+    if deltas:
+        await session.exec(
+            update(Medication)
+            .where(Medication.id.in_(deltas))
+            .values(taken_count=Medication.taken_count + case(deltas, value=Medication.id, else_=0))
+        )
+    await session.run_sync(bump_adherence, taken_adherence_rows(
+        user,
+        [(m, sf, now, 1) for m, sf in inserted] + [(m, sf, taken_at, -1) for (m, sf), (_, taken_at) in deleted.items()]
+    ))
+    await session.run_sync(
+        record_changes, user.id,
+        [("taken", i) for i in inserted.values()] + [("medication", m) for m in deltas],
+        [("taken", i) for i, _ in deleted.values()]
+    )
+    await session.commit()
+
+    results = []
+    for i, (med_id, scheduled_for, taken) in enumerate(ops):
+        key = (med_id, scheduled_for)
+        if med_id not in owned:
+            status_ = "not_found"
+        elif final[key][0] != i:
+            status_ = "superseded"
+        elif taken:
+            status_ = "ok" if key in inserted else "already_marked"
+        else:
+            status_ = "unmarked" if key in deleted else "not_taken"
+        results.append({"med_id": med_id, "scheduled_for": scheduled_for.isoformat(), "status": status_})
+    return {"results": results}
+
+# ----------------------------
+# DELTA SYNC
+# ----------------------------
+@app.get("/sync")
+async def sync_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(SYNC_PAGE_MAX, ge=1, le=SYNC_PAGE_MAX),
+    user: User = Depends(get_user_from_token),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Records created, updated or deleted after cursor `since` (0 = everything); pass the returned cursor back as `since` while has_more."""
+    seeded = (await session.exec(select(UserVersion.log_seeded).where(UserVersion.user_id == user.id))).first()
+    if not seeded:
+        await session.run_sync(seed_change_log, user.id)
+        await session.commit()
+
+    entries = (await session.exec(
+        select(ChangeLog.seq, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.deleted)
+        .where(ChangeLog.user_id == user.id, ChangeLog.seq > since)
+        .order_by(ChangeLog.seq).limit(limit + 1)
+    )).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    changed = {entity: set() for entity in SYNC_COLLECTIONS}
+    deleted = {entity: set() for entity in SYNC_COLLECTIONS}
+    for _, entity, entity_id, is_deleted in entries:
+        (deleted if is_deleted else changed)[entity].add(entity_id)
+
+    meds = (await session.exec(
+        select(Medication).where(Medication.id.in_(changed["medication"]), Medication.user_id == user.id)
+        .options(selectinload(Medication.times)).order_by(Medication.id)
+    )).all() if changed["medication"] else []
+    times = (await session.exec(
+        select(MedicationTime).join(Medication, Medication.id == MedicationTime.medication_id)
+        .where(MedicationTime.id.in_(changed["medication_time"]), Medication.user_id == user.id)
+        .order_by(MedicationTime.id)
+    )).all() if changed["medication_time"] else []
+    taken = (await session.exec(
+        select(Taken).join(Medication, Medication.id == Taken.medication_id)
+        .where(Taken.id.in_(changed["taken"]), Medication.user_id == user.id).order_by(Taken.id)
+    )).all() if changed["taken"] else []
+    vitals = (await session.exec(
+        select(Vitals).where(Vitals.id.in_(changed["vitals"]), Vitals.user_id == user.id).order_by(Vitals.id)
+    )).all() if changed["vitals"] else []
+
+    # A logged upsert whose row is gone was deleted by something outside the API; report it as a tombstone
+    for entity, rows in (("medication", meds), ("medication_time", times), ("taken", taken), ("vitals", vitals)):
+        deleted[entity] |= changed[entity] - {row.id for row in rows}
+
+    return {
+        "cursor": entries[-1].seq if entries else since,
+        "has_more": has_more,
+        # Times and scheduled_for values are wall-clock times in this zone
+        "timezone": user.timezone or "Asia/Kolkata",
+        "medications": [med_payload(m) for m in meds],
+        "medication_times": [
+            {"id": t.id, "med_id": t.medication_id, "time": t.time.strftime("%H:%M")} for t in times
+        ],
+        "taken": [
+            {
+                "id": t.id,
+                "med_id": t.medication_id,
+                "scheduled_for": t.scheduled_for.isoformat(),
+                "taken_at": t.taken_at.isoformat() if t.taken_at else None
+            }
+            for t in taken
+        ],
+        "vitals": [to_vitals_read(v) for v in vitals],
+        "deleted": {entity: sorted(ids) for entity, ids in deleted.items()},
+    }
+
+# ----------------------------
+# ADHERENCE
+# ----------------------------
+@app.get("/adherence")
+async def get_adherence(
+    days: int = Query(30, ge=1, le=366),
+    user: User = Depends(get_user_from_token),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Adherence over the last `days` complete local days, summed from the daily rollups (O(days), not O(doses))."""
+    today = user_today(user)
+    since = today - timedelta(days=days)
+    # Days the closer has not reached yet get missed computed on the fly
+    missed = case(
+        (AdherenceDaily.closed == True, AdherenceDaily.missed),
+        else_=case((AdherenceDaily.scheduled > AdherenceDaily.taken,
+                    AdherenceDaily.scheduled - AdherenceDaily.taken), else_=0)
+    )
+    rows = (await session.exec(
+        select(AdherenceDaily.medication_id, Medication.name,
+               func.sum(AdherenceDaily.scheduled), func.sum(AdherenceDaily.taken),
+               func.sum(AdherenceDaily.late), func.sum(missed))
+        .join(Medication, Medication.id == AdherenceDaily.medication_id)
+        .where(AdherenceDaily.user_id == user.id, AdherenceDaily.day >= since, AdherenceDaily.day < today)
+        .group_by(AdherenceDaily.medication_id, Medication.name)
+    )).all()
+
+    def summary(scheduled, taken, late, missed_count):
+        return {
+            "scheduled": scheduled,
+            "taken": taken,
+            "late": late,
+            "missed": missed_count,
+            "adherence": round(min(taken, scheduled) / scheduled, 3) if scheduled else None,
+        }
+
+    medications = [{"med_id": med_id, "name": name, **summary(*(int(v or 0) for v in totals))}
+                   for med_id, name, *totals in rows]
+    overall = summary(*(sum(m[k] for m in medications) for k in ("scheduled", "taken", "late", "missed")))
+    return {"since": since, "until": today - timedelta(days=1), "days": days, "overall": overall, "medications": medications}
+
+async def adherence_close_loop():
+    while True:
+        try:
+            async with AsyncSession(async_engine) as session:
+                # Scheduled counts come from materialized doses, so fill in every day before closing any;
+                # adherence must not depend on clients calling /reminders
+                await session.run_sync(extend_doses)
+                await session.run_sync(close_adherence_days)
+        except Exception:
+            logger.exception("Closing adherence days failed")
+        await asyncio.sleep(ADHERENCE_CLOSE_INTERVAL_SECONDS)
+
+_adherence_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_adherence_closer():
+    global _adherence_task
+    _adherence_task = asyncio.create_task(adherence_close_loop())
+
+@app.on_event("shutdown")
+async def stop_adherence_closer():
+    if _adherence_task is not None:
+        _adherence_task.cancel()
+
 @app.get("/me")
 def get_me(user: User = Depends(get_user_from_token)):
     return {"email": user.email}
 
+@app.get("/debug/pool")
+def debug_pool():
+    # Connection pool saturation and checkout wait, for sizing DB_POOL_SIZE against the uvicorn worker count
+    stats = {}
+    for name, pool in (("sync", engine.pool), ("async", async_engine.sync_engine.pool)):
+        if isinstance(pool, _TimedCheckoutMixin):
+            stats[name] = pool.stats.snapshot(pool)
+    return stats
+
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return Response(route_metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/debug_time")
 def debug_time():
     return {
@@ -531,8 +2373,15 @@ def delete_medication(
         raise HTTPException(status_code=404, detail="Medication not found")
 
     # Delete the medication (cascades will delete related times + taken records)
+    session.exec(delete(DoseOccurrence).where(DoseOccurrence.medication_id == med_id))
+    session.exec(delete(AdherenceDaily).where(AdherenceDaily.medication_id == med_id))
+    deletes = [("medication", med_id)]
+    deletes += [("medication_time", i) for i in session.exec(select(MedicationTime.id).where(MedicationTime.medication_id == med_id)).all()]
+    deletes += [("taken", i) for i in session.exec(select(Taken.id).where(Taken.medication_id == med_id)).all()]
     session.delete(med)
+    record_changes(session, user.id, deletes=deletes)
     session.commit()
+    reminder_scheduler.remove_medication(med_id)
 
     return {"status": "deleted", "med_id": med_id}
 
@@ -552,6 +2401,7 @@ def delete_vitals(
 
     # Delete the vital record
     session.delete(vital)
+    record_changes(session, user.id, deletes=[("vitals", id)])
     session.commit()
 
     return {"status": "deleted", "id": id}
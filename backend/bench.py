@@ -0,0 +1,302 @@
+"""
+Load-test / benchmark harness for the MedBuddy backend.
+
+Seeds a database with synthetic data (N users x M medications x K days of doses, intakes and vitals), then
+drives the FastAPI app in-process with a weighted workload mix from concurrent virtual clients, and reports
+p50/p95/p99 latency, throughput and SQL statements per request for each endpoint. Results are written as
+JSON so runs on different commits can be diffed (see --compare).
+
+Usage (from the repo root or backend/):
+    python backend/bench.py                                      # SQLite file bench.db, default sizes
+    python backend/bench.py --database-url postgresql://user:pw@localhost/medbuddy_bench --reset
+    python backend/bench.py --users 200 --meds 4 --days 90 --requests 20000 --concurrency 32
+    python backend/bench.py --compare bench-results/<older run>.json
+
+Latency is measured through httpx's ASGI transport, so it covers routing, validation, auth and the
+database but not the network or the HTTP server. Needs httpx (pip install httpx).
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+import contextvars
+from datetime import date, datetime, time as dtime, timedelta
+
+BENCH_PASSWORD = "bench-password"
+DEFAULT_MIX = "reminders=60,meds=15,taken=12,vitals=8,login=5"
+TIME_SLOTS = ["07:30", "08:00", "13:00", "14:30", "20:00", "22:00"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the MedBuddy backend endpoints.")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL", "sqlite:///./bench.db"),
+                        help="database to seed and run against (SQLite or Postgres)")
+    parser.add_argument("--reset", action="store_true",
+                        help="drop every table first; required when the database already has users")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--meds", type=int, default=3, help="medications per user")
+    parser.add_argument("--days", type=int, default=30, help="days of dose/intake/vitals history per user")
+    parser.add_argument("--requests", type=int, default=3000, help="total requests in the timed run")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent virtual clients")
+    parser.add_argument("--warmup", type=int, default=100, help="untimed requests before the run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted workload, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="result file (default bench-results/<commit>-<dialect>-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to print deltas against")
+    return parser.parse_args()
+
+
+args = parse_args()
+# The app builds its engines at import time
+os.environ["DATABASE_URL"] = args.database_url
+# Per-request log lines would dominate the run; slow queries and errors still get through
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from sqlmodel import SQLModel, Session, select, func  # noqa: E402
+import app as server  # noqa: E402
+
+# ----------------------------
+# SQL statement counting (per request, via a context variable set around each call)
+# ----------------------------
+_request_queries = contextvars.ContextVar("bench_request_queries", default=None)
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = _request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+event.listen(server.engine, "before_cursor_execute", _count_statement)
+event.listen(server.async_engine.sync_engine, "before_cursor_execute", _count_statement)
+
+# ----------------------------
+# Synthetic data
+# ----------------------------
+def prepare_database():
+    if args.reset:
+        SQLModel.metadata.drop_all(server.engine)
+    server.create_db_and_tables()
+    with Session(server.engine) as session:
+        if session.exec(select(func.count()).select_from(server.User)).one():
+            sys.exit("Database already has users; pass --reset to drop everything and reseed.")
+
+
+def seed(rng: random.Random):
+    """Insert users, medications (with times and materialized doses), intakes and vitals; returns the users."""
+    hashed = server.get_password_hash(BENCH_PASSWORD)
+    today = date.today()
+    first_day = today - timedelta(days=args.days)
+    started = time.perf_counter()
+    with Session(server.engine) as session:
+        users = [server.User(email=f"bench{i}@example.com", hashed_password=hashed) for i in range(args.users)]
+        session.add_all(users)
+        session.commit()
+        for user in users:
+            for m in range(args.meds):
+                slots = sorted(rng.sample(TIME_SLOTS, rng.randint(1, 3)))
+                med = server.Medication(
+                    user_id=user.id, name=f"med-{m}", dose=f"{rng.choice([5, 10, 20, 50])}mg",
+                    start_date=first_day, quantity=args.days * len(slots) * 2,
+                    times=[server.MedicationTime(time=datetime.strptime(t, "%H:%M").time()) for t in slots]
+                )
+                session.add(med)
+                session.flush()
+                times = [t.time for t in med.times]
+                server.materialize_doses(session, med, times, first_day, today + timedelta(days=server.DOSE_HORIZON_DAYS))
+                # Roughly 85% adherence over the history, taken up to 90 minutes late
+                taken = [
+                    {"medication_id": med.id, "scheduled_for": datetime.combine(day, t),
+                     "taken_at": datetime.combine(day, t) + timedelta(minutes=rng.randint(0, 90))}
+                    for day in (first_day + timedelta(days=d) for d in range(args.days))
+                    for t in times if rng.random() < 0.85
+                ]
+                server.insert_ignore(session, server.Taken, taken, ["medication_id", "scheduled_for"])
+                med.taken_count = len(taken)
+            vitals = []
+            for d in range(args.days):
+                for _ in range(rng.randint(1, 2)):
+                    bp = f"{rng.randint(105, 150)}/{rng.randint(65, 95)}"
+                    hr = str(rng.randint(55, 100))
+                    temp = f"{rng.uniform(36.1, 37.8):.1f}"
+                    record_time = datetime.combine(first_day + timedelta(days=d), dtime(rng.randint(6, 22), rng.randint(0, 59)))
+                    vitals.append({"user_id": user.id, "record_time": record_time, "bp": bp, "hr": hr, "temp": temp,
+                                   **server.parse_vitals(bp, hr, temp)})
+            server.insert_ignore(session, server.Vitals, vitals, ["user_id", "record_time"])
+            session.commit()
+        print(f"Seeded {args.users} users x {args.meds} meds x {args.days} days in {time.perf_counter() - started:.1f}s")
+        return [(u.id, u.email) for u in users]
+
+# ----------------------------
+# Workload
+# ----------------------------
+def build_operations(users, rng: random.Random):
+    tokens = {uid: server.create_access_token({"sub": str(uid)}) for uid, _ in users}
+    emails = dict(users)
+
+    def auth(uid):
+        return {"Authorization": f"Bearer {tokens[uid]}"}
+
+    def reminders(uid):
+        return "GET", "/reminders", {"headers": auth(uid)}
+
+    def meds(uid):
+        return "GET", "/meds", {"headers": auth(uid)}
+
+    def taken(uid):
+        day = date.today() - timedelta(days=rng.randint(0, args.days - 1))
+        return "GET", "/taken", {"headers": auth(uid), "params": {"date_str": day.isoformat()}}
+
+    def vitals(uid):
+        return "GET", "/vitals", {"headers": auth(uid), "params": {"limit": 20}}
+
+    def login(uid):
+        return "POST", "/token", {"data": {"username": emails[uid], "password": BENCH_PASSWORD}}
+
+    available = {"reminders": reminders, "meds": meds, "taken": taken, "vitals": vitals, "login": login}
+    mix = {}
+    for part in args.mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in available:
+            sys.exit(f"Unknown operation in --mix: {name!r} (choose from {', '.join(available)})")
+        mix[name.strip()] = float(weight or 1)
+    return available, mix
+
+
+async def run_workload(client, users, rng: random.Random, total: int, samples=None):
+    available, mix = build_operations(users, rng)
+    names, weights = list(mix), list(mix.values())
+    user_ids = [uid for uid, _ in users]
+    remaining = [total]
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            name = rng.choices(names, weights)[0]
+            method, path, kwargs = available[name](rng.choice(user_ids))
+            counter = [0]
+            reset = _request_queries.set(counter)
+            started = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            elapsed = time.perf_counter() - started
+            _request_queries.reset(reset)
+            if samples is not None:
+                samples.setdefault(name, []).append((elapsed, counter[0], response.status_code))
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+# ----------------------------
+# Reporting
+# ----------------------------
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+def summarize(samples, wall_seconds):
+    def stats(rows):
+        latencies = sorted(r[0] * 1000 for r in rows)
+        return {
+            "requests": len(rows),
+            "errors": sum(1 for r in rows if r[2] >= 400),
+            "throughput_rps": round(len(rows) / wall_seconds, 1),
+            "mean_ms": round(sum(latencies) / len(latencies), 2),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "max_ms": round(latencies[-1], 2),
+            "queries_per_request": round(sum(r[1] for r in rows) / len(rows), 2),
+        }
+
+    all_rows = [row for rows in samples.values() for row in rows]
+    return {
+        "overall": {**stats(all_rows), "wall_seconds": round(wall_seconds, 2)},
+        "endpoints": {name: stats(rows) for name, rows in sorted(samples.items())},
+    }
+
+
+def git_revision():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=here, capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def print_report(result, baseline=None):
+    columns = ("requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "queries_per_request")
+    print(f"\n{'endpoint':<12}" + "".join(f"{c:>20}" for c in columns))
+    rows = list(result["endpoints"].items()) + [("overall", result["overall"])]
+    for name, stats in rows:
+        line = f"{name:<12}"
+        for column in columns:
+            value = stats[column]
+            cell = f"{value}"
+            old = (baseline or {}).get("endpoints", {}).get(name) if name != "overall" else (baseline or {}).get("overall")
+            if old and column not in ("requests", "errors") and old.get(column):
+                cell += f" ({(value - old[column]) / old[column] * 100:+.0f}%)"
+            line += f"{cell:>20}"
+        print(line)
+
+
+async def main():
+    rng = random.Random(args.seed)
+    prepare_database()
+    users = seed(rng)
+
+    await server.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await run_workload(client, users, rng, args.warmup)
+            samples = {}
+            started = time.perf_counter()
+            await run_workload(client, users, rng, args.requests, samples)
+            wall_seconds = time.perf_counter() - started
+    finally:
+        await server.app.router.shutdown()
+
+    commit, dirty = git_revision()
+    result = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "dialect": server.engine.dialect.name,
+            "python": platform.python_version(),
+            "params": {k: getattr(args, k) for k in ("users", "meds", "days", "requests", "concurrency", "warmup", "mix", "seed")},
+        },
+        **summarize(samples, wall_seconds),
+    }
+
+    output = args.output or os.path.join(
+        "bench-results", f"{commit or 'nogit'}-{result['meta']['dialect']}-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
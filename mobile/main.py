@@ -2,13 +2,481 @@ import kivy
 from kivy.app import App
 from kivy.uix.screenmanager import ScreenManager, Screen
 from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.gridlayout import GridLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.widget import Widget
 from kivy.uix.label import Label
 from kivy.uix.button import Button
 from kivy.uix.textinput import TextInput
+from kivy.clock import Clock
+from kivy.logger import Logger
+from kivy.utils import platform
+import os
+import json
+import hmac
+import sqlite3
+import hashlib
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    from plyer import notification
+except ImportError:  # desktop runs without plyer still show reminders on screen
+    notification = None
+try:
+    from jnius import autoclass
+except ImportError:  # desktop: dose alarms fall back to Kivy Clock timers
+    autoclass = None
 
 API_BASE = "http://127.0.0.1:8000"
+# How often the local store replays queued writes and pulls /sync when nothing pokes it sooner
+SYNC_INTERVAL_SECONDS = 60
+# A queued write the server keeps failing with 5xx is set aside after this many tries, so it can't block the rest
+OUTBOX_MAX_ATTEMPTS = 5
+# How often due reminders are recomputed from the local store
+REMINDER_CHECK_SECONDS = 30
+# Longest a dose alarm sleeps before re-checking the wall clock (Clock timers drift if the device sleeps)
+ALARM_RECHECK_SECONDS = 15 * 60
+# python-for-android service (buildozer.spec: services = Dosealarm:service.py) that Android dose alarms start
+ALARM_SERVICE_NAME = "Dosealarm"
+# Same window as the server's /reminders defaults
+REMINDER_MINUTES_BEFORE = 15
+REMINDER_MINUTES_AFTER = 5
+# The server's zone for accounts that never set one; /sync reports the real one
+DEFAULT_TIMEZONE = "Asia/Kolkata"
+
+# One-off network calls (login, register) run here so the Kivy main loop never waits on HTTP
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="medbuddy-net")
+
+
+def run_in_background(fn, *args, on_done=None, on_error=None):
+    """Run fn(*args) on the network pool; on_done(result) or on_error(exc) is then called on the Kivy main thread."""
+    def finished(future):
+        exc = future.exception()
+        if exc is not None:
+            if on_error:
+                Clock.schedule_once(lambda dt: on_error(exc))
+        elif on_done:
+            result = future.result()
+            Clock.schedule_once(lambda dt: on_done(result))
+    future = _executor.submit(fn, *args)
+    future.add_done_callback(finished)
+    return future
+
+
+class ApiClient:
+    """Every call to the backend goes through one pooled, keep-alive requests.Session.
+
+    It adds the bearer token, retries with exponential backoff (connection failures always; 502/503/504 only for
+    idempotent methods) and lets gzip responses decompress transparently (brotli too when the brotli package is
+    installed).
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.token = None
+        self.session = requests.Session()
+        retry = Retry(total=3, connect=2, read=0, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                      respect_retry_after_header=True, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=8, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+    def set_token(self, token):
+        self.token = token
+
+    def request(self, method, path, timeout=10, headers=None, **kwargs):
+        headers = dict(headers or {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        return self.session.request(method, f"{self.base}{path}", headers=headers, timeout=timeout, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+
+api = ApiClient(API_BASE)
+
+
+class LocalStore:
+    """On-device SQLite mirror of one user's meds (with their times), taken doses and vitals, plus a durable write queue.
+
+    Screens render from here without touching the network; Syncer keeps it current in the background.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS meds (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS taken (id INTEGER PRIMARY KEY, med_id INTEGER NOT NULL, scheduled_for TEXT NOT NULL, taken_at TEXT);
+            CREATE INDEX IF NOT EXISTS ix_taken_scheduled_for ON taken (scheduled_for);
+            CREATE TABLE IF NOT EXISTS vitals (id INTEGER PRIMARY KEY, record_time TEXT NOT NULL, data TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS ix_vitals_record_time ON vitals (record_time);
+            CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, method TEXT NOT NULL, path TEXT NOT NULL, body TEXT,
+                                               idempotency_key TEXT);
+            CREATE TABLE IF NOT EXISTS outbox_failed (id INTEGER PRIMARY KEY, method TEXT NOT NULL, path TEXT NOT NULL, body TEXT, status INTEGER,
+                                                      idempotency_key TEXT);
+        """)
+        # Stores created before writes carried an idempotency key
+        for table in ("outbox", "outbox_failed"):
+            if "idempotency_key" not in {row[1] for row in self.db.execute(f"PRAGMA table_info({table})")}:
+                self.db.execute(f"ALTER TABLE {table} ADD COLUMN idempotency_key TEXT")
+
+    @classmethod
+    def for_user(cls, email):
+        # One file per account, so switching users never mixes (or drops) anyone's queued writes
+        digest = hashlib.sha1(email.strip().lower().encode()).hexdigest()[:16]
+        return cls(os.path.join(App.get_running_app().user_data_dir, f"medbuddy_{digest}.db"))
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self._lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def remember_login(self, password, token):
+        salt = os.urandom(16)
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, 100_000)
+        self.set_meta("password", f"{salt.hex()}:{digest.hex()}")
+        self.set_meta("token", token)
+
+    def offline_token(self, password):
+        """The last server token, if password matches the one it was issued for; lets the app open without network."""
+        stored = self.get_meta("password")
+        if not stored:
+            return None
+        salt, digest = stored.split(":")
+        candidate = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), 100_000).hex()
+        return self.get_meta("token") if hmac.compare_digest(candidate, digest) else None
+
+    def apply_sync(self, payload):
+        """Apply one /sync page; returns True if anything changed."""
+        deleted = payload.get("deleted", {})
+        with self._lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO meds (id, data) VALUES (?, ?)",
+                                [(m["id"], json.dumps(m)) for m in payload.get("medications", [])])
+            self.db.executemany("INSERT OR REPLACE INTO taken (id, med_id, scheduled_for, taken_at) VALUES (?, ?, ?, ?)",
+                                [(t["id"], t["med_id"], t["scheduled_for"], t["taken_at"]) for t in payload.get("taken", [])])
+            self.db.executemany("INSERT OR REPLACE INTO vitals (id, record_time, data) VALUES (?, ?, ?)",
+                                [(v["id"], v["record_time"], json.dumps(v)) for v in payload.get("vitals", [])])
+            # Times arrive inside each medication (and never change on their own), so medication_time deltas need no table
+            for table, entity in (("meds", "medication"), ("taken", "taken"), ("vitals", "vitals")):
+                self.db.executemany(f"DELETE FROM {table} WHERE id = ?", [(i,) for i in deleted.get(entity, [])])
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('cursor', ?)", (str(payload["cursor"]),))
+            if payload.get("timezone"):
+                self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('timezone', ?)", (payload["timezone"],))
+        return any(payload.get(k) for k in ("medications", "taken", "vitals")) or any(deleted.values())
+
+    def _pending(self, path):
+        rows = self.db.execute("SELECT body FROM outbox WHERE method = 'POST' AND path = ? ORDER BY id", (path,))
+        return [dict(json.loads(body), id=None, pending=True) for (body,) in rows]
+
+    def meds(self):
+        """Synced medications, then the ones still waiting in the outbox."""
+        with self._lock:
+            synced = [json.loads(data) for (data,) in self.db.execute("SELECT data FROM meds ORDER BY id")]
+            return synced + self._pending("/meds")
+
+    def vitals(self, limit=None):
+        """Newest first, readings still waiting in the outbox included."""
+        with self._lock:
+            query, params = "SELECT data FROM vitals ORDER BY record_time DESC", ()
+            if limit:
+                query, params = query + " LIMIT ?", (limit,)
+            rows = [json.loads(data) for (data,) in self.db.execute(query, params)] + self._pending("/vitals")
+        rows.sort(key=lambda v: v.get("record_time") or "", reverse=True)
+        return rows[:limit] if limit else rows
+
+    def timezone(self):
+        """The account's zone: medication times and scheduled_for values are wall-clock times there, not on the device."""
+        return ZoneInfo(self.get_meta("timezone") or DEFAULT_TIMEZONE)
+
+    def doses_between(self, start, end):
+        """Untaken doses scheduled in [start, end] (aware datetimes), computed from the cached schedule.
+
+        Each dose's "at" is its aware instant in the account's timezone.
+        """
+        tz = self.timezone()
+        start = start.astimezone(tz).replace(tzinfo=None)
+        end = end.astimezone(tz).replace(tzinfo=None)
+        with self._lock:
+            taken = {(med_id, scheduled_for[:16]) for med_id, scheduled_for in self.db.execute(
+                "SELECT med_id, scheduled_for FROM taken WHERE scheduled_for >= ?", (start.date().isoformat(),))}
+        days = [start.date() + timedelta(days=i) for i in range((end.date() - start.date()).days + 1)]
+        doses = []
+        for med in self.meds():
+            for day in days:
+                if med.get("start_date") and day.isoformat() < med["start_date"]:
+                    continue
+                if med.get("end_date") and day.isoformat() > med["end_date"]:
+                    continue
+                for hhmm in med.get("times", []):
+                    scheduled = datetime.combine(day, datetime.strptime(hhmm, "%H:%M").time())
+                    if start <= scheduled <= end and (med.get("id"), scheduled.isoformat()[:16]) not in taken:
+                        doses.append({
+                            "med_id": med.get("id"),
+                            "name": med.get("name"),
+                            "dose": med.get("dose"),
+                            "scheduled_for": scheduled.replace(tzinfo=tz).isoformat(),
+                            "at": scheduled.replace(tzinfo=tz)
+                        })
+        return sorted(doses, key=lambda r: r["at"])
+
+    def due_reminders(self, now):
+        """Doses in the same window /reminders uses, with no network."""
+        return self.doses_between(now - timedelta(minutes=REMINDER_MINUTES_BEFORE),
+                                  now + timedelta(minutes=REMINDER_MINUTES_AFTER))
+
+    def schedule_signature(self):
+        """Changes exactly when some medication's times or date range, or the timezone, change (vitals and intakes leave it alone)."""
+        return hash((self.get_meta("timezone"),) + tuple(
+            (m.get("id"), tuple(m.get("times", [])), m.get("start_date"), m.get("end_date")) for m in self.meds()
+        ))
+
+    def enqueue(self, method, path, body):
+        # The key goes out with every replay, so a write whose response was lost is not applied twice
+        with self._lock, self.db:
+            self.db.execute("INSERT INTO outbox (method, path, body, idempotency_key) VALUES (?, ?, ?, ?)",
+                            (method, path, json.dumps(body), uuid.uuid4().hex))
+
+    def outbox(self):
+        with self._lock:
+            rows = self.db.execute("SELECT id, method, path, body, idempotency_key FROM outbox ORDER BY id").fetchall()
+        return [(entry_id, method, path, json.loads(body) if body else None, key) for entry_id, method, path, body, key in rows]
+
+    def drop(self, entry_id):
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+
+    def set_aside(self, entry_id, status):
+        """Move a write the server rejected (or keeps failing on) out of the outbox, keeping it for the user to see."""
+        with self._lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO outbox_failed (id, method, path, body, status, idempotency_key) "
+                            "SELECT id, method, path, body, ?, idempotency_key FROM outbox WHERE id = ?", (status, entry_id))
+            self.db.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+
+    def failed_writes(self):
+        """Writes set aside by set_aside(), oldest first, as (method, path, body, status)."""
+        with self._lock:
+            rows = self.db.execute("SELECT method, path, body, status FROM outbox_failed ORDER BY id").fetchall()
+        return [(method, path, json.loads(body) if body else None, status) for method, path, body, status in rows]
+
+    def dismiss_failed_writes(self):
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM outbox_failed")
+
+
+class Syncer:
+    """Replays the store's outbox, then pulls /sync deltas into it, in a background thread.
+
+    Runs every SYNC_INTERVAL_SECONDS and whenever poke() is called; on_change is called on the Kivy main thread.
+    """
+
+    def __init__(self, store, on_change):
+        self.store = store
+        self.on_change = on_change
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        # Server-error count per outbox entry; offline rounds and 401/408/429 don't count
+        self._attempts = {}
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def poke(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            changed = False
+            try:
+                changed = self._flush()
+                changed = self._pull() or changed
+            except requests.RequestException:
+                pass  # offline: queued writes stay put for the next round
+            if changed and not self._stop.is_set():
+                Clock.schedule_once(lambda dt: self.on_change())
+            self._wake.wait(SYNC_INTERVAL_SECONDS)
+            self._wake.clear()
+
+    def _flush(self):
+        """Send queued writes oldest first, stopping at the first one the server cannot take yet."""
+        sent = False
+        for entry_id, method, path, body, key in self.store.outbox():
+            response = api.request(method, path, json=body, headers={"Idempotency-Key": key} if key else None)
+            if response.status_code >= 500:
+                self._attempts[entry_id] = self._attempts.get(entry_id, 0) + 1
+                if self._attempts[entry_id] < OUTBOX_MAX_ATTEMPTS:
+                    break
+                Logger.warning("MedBuddy: giving up on %s %s after %d server errors", method, path, OUTBOX_MAX_ATTEMPTS)
+                self._attempts.pop(entry_id)
+                self.store.set_aside(entry_id, response.status_code)
+                sent = True
+                continue
+            if response.status_code in (401, 408, 429):
+                break
+            self._attempts.pop(entry_id, None)
+            if response.status_code >= 400 and response.status_code != 409:
+                # Rejected for good (400/404/422...): keep it where the home screen shows it instead of losing it
+                Logger.warning("MedBuddy: server rejected %s %s with %d", method, path, response.status_code)
+                self.store.set_aside(entry_id, response.status_code)
+                sent = True
+                continue
+            # Accepted, or already applied (409 for a reading already recorded): either way it is done
+            self.store.drop(entry_id)
+            sent = True
+        return sent
+
+    def _pull(self):
+        # The first sync always counts as a change: it replaces the screens' "Loading..." placeholders
+        changed = self.store.get_meta("cursor") is None
+        while True:
+            response = api.get("/sync", params={"since": self.store.get_meta("cursor", "0")}, timeout=30)
+            if response.status_code != 200:
+                return changed
+            payload = response.json()
+            changed = self.store.apply_sync(payload) or changed
+            if not payload.get("has_more"):
+                return changed
+
+
+def dose_notification(dose, at):
+    return f"Time for {dose['name']}", f"Take {dose['dose'] or 'your dose'} (scheduled {at.strftime('%H:%M')})"
+
+
+class AndroidAlarms:
+    """Exact AlarmManager alarms, one per dose instant, each starting the dose-alarm service that posts its notifications.
+
+    They fire with the app closed and while the device dozes, which a Kivy Clock timer never does.
+    """
+
+    def __init__(self):
+        self._activity = autoclass("org.kivy.android.PythonActivity").mActivity
+        self._manager = self._activity.getSystemService(autoclass("android.content.Context").ALARM_SERVICE)
+        self._service = autoclass(f"{self._activity.getPackageName()}.Service{ALARM_SERVICE_NAME}")
+        self._AlarmManager = autoclass("android.app.AlarmManager")
+        self._PendingIntent = autoclass("android.app.PendingIntent")
+        self._sdk = autoclass("android.os.Build$VERSION").SDK_INT
+        self._armed = 0
+
+    def _pending(self, code, notifications):
+        # Alarms are told apart by request code alone, so cancelling needs the code, not the same extras
+        intent = self._service.getDefaultIntent(self._activity, "", "MedBuddy", json.dumps(notifications))
+        flags = self._PendingIntent.FLAG_UPDATE_CURRENT | self._PendingIntent.FLAG_IMMUTABLE
+        return self._PendingIntent.getService(self._activity, code, intent, flags)
+
+    def set(self, instants):
+        """Replace the armed alarms with one per (aware instant, [(title, message), ...])."""
+        self.cancel()
+        # Android 12+ only allows exact alarms once the user grants them; inexact ones still survive doze
+        exact = self._sdk < 31 or self._manager.canScheduleExactAlarms()
+        for code, (at, notifications) in enumerate(instants):
+            trigger = int(at.timestamp() * 1000)
+            pending = self._pending(code, notifications)
+            if exact:
+                self._manager.setExactAndAllowWhileIdle(self._AlarmManager.RTC_WAKEUP, trigger, pending)
+            else:
+                self._manager.setAndAllowWhileIdle(self._AlarmManager.RTC_WAKEUP, trigger, pending)
+        self._armed = len(instants)
+
+    def cancel(self):
+        for code in range(self._armed):
+            self._manager.cancel(self._pending(code, []))
+        self._armed = 0
+
+
+class DoseAlarms:
+    """Fires a local notification at the exact instant of each upcoming dose, straight from the cached schedule.
+
+    On Android every dose instant of the next day is handed to AlarmManager (AndroidAlarms), so notifications
+    arrive with the app closed; elsewhere Kivy Clock is the fallback and notifies while the app runs. Either way
+    one Clock event follows the next dose instant to run on_fire and re-plan. sync() re-plans only when the
+    schedule signature changed, so syncs that bring vitals or intakes cost nothing.
+    """
+
+    def __init__(self, store, on_fire):
+        self.store = store
+        self.on_fire = on_fire
+        self._event = None
+        self._signature = None
+        self._after = None
+        self._os_alarms = None
+        if platform == "android" and autoclass is not None:
+            try:
+                self._os_alarms = AndroidAlarms()
+            except Exception:
+                Logger.exception("MedBuddy: AlarmManager unavailable, dose alarms only fire while the app runs")
+
+    def sync(self):
+        signature = self.store.schedule_signature()
+        if signature != self._signature:
+            self._signature = signature
+            self.arm()
+
+    def arm(self, after=None):
+        self.cancel()
+        now = datetime.now(timezone.utc)
+        self._after = after = max(after or now, now)
+        upcoming = self.store.doses_between(after, after + timedelta(days=1))
+        if self._os_alarms is not None:
+            instants = {}
+            for dose in upcoming:
+                instants.setdefault(dose["at"], []).append(dose_notification(dose, dose["at"]))
+            self._os_alarms.set(list(instants.items()))
+        if not upcoming:
+            # Nothing in the next day: look again later (sync() re-plans sooner if the schedule changes)
+            self._event = Clock.schedule_once(lambda dt: self.arm(), ALARM_RECHECK_SECONDS)
+            return
+        at = upcoming[0]["at"]
+        self._event = Clock.schedule_once(lambda dt: self._wake(at), min((at - now).total_seconds(), ALARM_RECHECK_SECONDS))
+
+    def _wake(self, at):
+        if datetime.now(timezone.utc) < at - timedelta(seconds=1):
+            self.arm(self._after)  # woke up early to correct drift
+            return
+        if self._os_alarms is None:
+            for dose in self.store.doses_between(at, at):
+                notify(*dose_notification(dose, at))
+        self.on_fire()
+        self.arm(at + timedelta(seconds=1))
+
+    def cancel(self):
+        if self._event is not None:
+            self._event.cancel()
+            self._event = None
+        if self._os_alarms is not None:
+            self._os_alarms.cancel()
+
+
+def notify(title, message):
+    if notification is None:
+        Logger.info("MedBuddy: reminder %s: %s", title, message)
+        return
+    try:
+        notification.notify(title=title, message=message, app_name="MedBuddy")
+    except NotImplementedError:
+        Logger.info("MedBuddy: reminder %s: %s", title, message)
+
 
 class LoginScreen(Screen):
     def __init__(self, **kwargs):
@@ -16,165 +484,198 @@ class LoginScreen(Screen):
         layout = BoxLayout(orientation='vertical', padding=20, spacing=10)
         self.email_input = TextInput(hint_text='Email', multiline=False, size_hint=(None, None), width=250, height=35, pos_hint={'center_x': 0.5})
         self.password_input = TextInput(hint_text='Password', password=True, multiline=False, size_hint=(None, None), width=250, height=35, pos_hint={'center_x': 0.5})
-        login_btn = Button(text='Login', size_hint=(None, None), width=250, height=40, pos_hint={'center_x': 0.5})
-        login_btn.bind(on_press=self.login)
+        self.login_btn = Button(text='Login', size_hint=(None, None), width=250, height=40, pos_hint={'center_x': 0.5})
+        self.login_btn.bind(on_press=self.login)
         self.message_label = Label(text='')
         layout.add_widget(self.email_input)
         layout.add_widget(self.password_input)
-        layout.add_widget(login_btn)
+        layout.add_widget(self.login_btn)
         layout.add_widget(self.message_label)
         self.add_widget(layout)
 
+    def enter_app(self, email, token, store):
+        App.get_running_app().store = store
+        self.manager.current = "main"
+        main_screen = self.manager.get_screen("main")
+        main_screen.set_user_email(email)
+        main_screen.set_token(token)
+
     def login(self, instance):
         email = self.email_input.text
         password = self.password_input.text
+        self.login_btn.disabled = True
+        self.message_label.text = "Signing in..."
+        run_in_background(self.authenticate, email, password, on_done=self.on_login, on_error=self.on_login_error)
+
+    def authenticate(self, email, password):
+        """Runs on the network pool: returns (email, token, store, message); store is None when login failed."""
         try:
-            response = requests.post(f"{API_BASE}/token", data={"username": email, "password": password})
-            if response.status_code == 200:
-                resp_json = response.json()
-                token = resp_json["access_token"]
-                user_email = resp_json.get("email", email)
-                self.manager.current = "main"
-                main_screen = self.manager.get_screen("main")
-                main_screen.set_user_email(user_email)
-                main_screen.set_token(token)
-            else:
-                reg_response = requests.post(f"{API_BASE}/register", json={"email": email, "password": password})
-                if reg_response.status_code == 200:
-                    resp_json = reg_response.json()
-                    token = resp_json["access_token"]
-                    user_email = resp_json.get("email", email)
-                    self.manager.current = "main"
-                    main_screen = self.manager.get_screen("main")
-                    main_screen.set_user_email(user_email)
-                    main_screen.set_token(token)
-                    self.message_label.text = "Account created and logged in."
-                else:
-                    try:
-                        error_msg = reg_response.json().get("detail", "Login failed. Check credentials.")
-                    except Exception:
-                        error_msg = "Login failed. Check credentials."
-                    self.message_label.text = error_msg
-        except Exception as e:
-            self.message_label.text = f"Error: {e}"
+            response = api.post("/token", data={"username": email, "password": password})
+            message = ""
+            if response.status_code != 200:
+                response = api.post("/register", json={"email": email, "password": password})
+                message = "Account created and logged in."
+            if response.status_code != 200:
+                try:
+                    error_msg = response.json().get("detail", "Login failed. Check credentials.")
+                except Exception:
+                    error_msg = "Login failed. Check credentials."
+                return email, None, None, error_msg
+            resp_json = response.json()
+            token = resp_json["access_token"]
+            user_email = resp_json.get("email", email)
+            store = LocalStore.for_user(user_email)
+            store.remember_login(password, token)
+            return user_email, token, store, message
+        except (requests.ConnectionError, requests.Timeout):
+            # No network: open the saved data if this password unlocked it last time
+            store = LocalStore.for_user(email)
+            token = store.offline_token(password)
+            if token:
+                return email, token, store, "Offline: showing saved data."
+            store.close()
+            return email, None, None, "No connection, and no saved login for this account."
+
+    def on_login(self, result):
+        email, token, store, message = result
+        self.login_btn.disabled = False
+        self.message_label.text = message
+        if store is not None:
+            self.enter_app(email, token, store)
+
+    def on_login_error(self, exc):
+        self.login_btn.disabled = False
+        self.message_label.text = f"Error: {exc}"
+
+def med_row_text(med):
+    name = med.get('name', '')
+    dose = med.get('dose', '')
+    times = med.get('times', [])
+    schedule = ", ".join(times) if isinstance(times, list) else str(times)
+    start_date = med.get('start_date', '')
+    end_date = med.get('end_date', '')
+    med_text = f"Name: {name} | Dose: {dose} | Schedule: {schedule} | Start: {start_date} | End: {end_date}"
+    return med_text + " (pending)" if med.get('pending') else med_text
+
+
+def vital_row_text(vital):
+    bp = vital.get('bp', vital.get('value', ''))
+    hr = vital.get('hr', '')
+    temp = vital.get('temp', '')
+    record_time = vital.get('record_time', '')
+    vital_text = f"BP: {bp} | HR: {hr} | Temp: {temp} | Time: {record_time}"
+    return vital_text + " (pending)" if vital.get('pending') else vital_text
+
+def failed_write_text(path, body, status):
+    if path == '/meds' and body:
+        return f"{body.get('name', 'medication')} ({status})"
+    if path == '/vitals' and body:
+        return f"vitals at {body.get('record_time', '')} ({status})"
+    return f"{path} ({status})"
+
+
+class RowList(RecycleView):
+    """Scrollable list of text rows; only the rows on screen get widgets, so cost does not grow with history.
+
+    With max_rows set it sizes itself to at most that many rows (for the short lists on the home screen).
+    """
+
+    def __init__(self, row_height=40, max_rows=None, **kwargs):
+        super().__init__(**kwargs)
+        self.row_height = row_height
+        self.max_rows = max_rows
+        self.viewclass = 'Label'
+        layout = RecycleBoxLayout(orientation='vertical', default_size=(None, row_height),
+                                  default_size_hint=(1, None), size_hint_y=None)
+        layout.bind(minimum_height=layout.setter('height'))
+        self.add_widget(layout)
+
+    def set_rows(self, texts):
+        """Swap in a new data model; identical data is a no-op, otherwise only the visible rows are rebound."""
+        data = [{"text": text} for text in texts]
+        if data != self.data:
+            self.data = data
+        if self.max_rows is not None:
+            self.height = self.row_height * min(len(data), self.max_rows)
+
 
 class MainScreen(Screen):
     def set_user_email(self, email):
         self.user_email = email
-        print(f"DEBUG: Set user_email to {email}")
     def show_vitals(self):
-        self.vitals_list.clear_widgets()
-        headers = {"Authorization": f"Bearer {self.token}"}
-        try:
-            response = requests.get(f"{API_BASE}/vitals", headers=headers)
-            if response.status_code == 200:
-                vitals = response.json()
-                vitals_sorted = sorted(vitals, key=lambda v: v.get('record_time', ''), reverse=True)
-                for vital in vitals_sorted[:5]:
-                    bp = vital.get('bp', vital.get('value', ''))
-                    hr = vital.get('hr', '')
-                    temp = vital.get('temp', '')
-                    record_time = vital.get('record_time', '')
-                    vital_text = f"BP: {bp} | HR: {hr} | Temp: {temp} | Time: {record_time}"
-                    vital_label = Label(text=vital_text, size_hint_y=None, height=40)
-                    self.vitals_list.add_widget(vital_label)
-                self.show_more_vitals_btn.opacity = 1 if len(vitals) > 5 else 0
-            else:
-                self.vitals_list.add_widget(Label(text="Failed to load vitals", size_hint_y=None, height=30))
-        except Exception as e:
-            self.vitals_list.add_widget(Label(text=f"Error: {e}", size_hint_y=None, height=30))
-    def show_all_vitals(self, instance):
-        self.clear_widgets()
-        temp_layout = BoxLayout(orientation='vertical', padding=20, spacing=10)
-        # Center the vitals_list horizontally
-        vitals_list_box = BoxLayout(orientation='horizontal', size_hint=(1, None))
-        vitals_list_box.add_widget(Label(size_hint_x=0.25))
-        vitals_list = GridLayout(cols=1, size_hint=(0.5, None), width=250, padding=[0,10,0,0], spacing=5)
-        vitals_list.bind(minimum_height=vitals_list.setter('height'))
-        # Add the title label as the first item in the grid
-        title_label = Label(text='All Vitals', font_size=18, size_hint=(None, None), width=250, height=50, halign='center', valign='middle')
-        title_label.bind(size=title_label.setter('text_size'))
-        vitals_list.add_widget(title_label)
-        headers = {"Authorization": f"Bearer {self.token}"}
-        try:
-            response = requests.get(f"{API_BASE}/vitals", headers=headers)
-            if response.status_code == 200:
-                vitals = response.json()
-                # Sort vitals by record_time descending
-                vitals_sorted = sorted(vitals, key=lambda v: v.get('record_time', ''), reverse=True)
-                for vital in vitals_sorted:
-                    bp = vital.get('bp', vital.get('value', ''))
-                    hr = vital.get('hr', '')
-                    temp = vital.get('temp', '')
-                    record_time = vital.get('record_time', '')
-                    vital_text = f"BP: {bp} | HR: {hr} | Temp: {temp} | Time: {record_time}"
-                    vital_label = Label(text=vital_text, size_hint=(None, None), width=250, height=30, halign='center', valign='middle')
-                    vital_label.bind(size=vital_label.setter('text_size'))
-                    vitals_list.add_widget(vital_label)
-            else:
-                vitals_list.add_widget(Label(text="Failed to load vitals", size_hint=(None, None), width=250, height=30, halign='center', valign='middle'))
-        except Exception as e:
-            vitals_list.add_widget(Label(text=f"Error: {e}", size_hint=(None, None), width=250, height=30, halign='center', valign='middle'))
-        vitals_list_box.add_widget(vitals_list)
-        vitals_list_box.add_widget(Label(size_hint_x=0.25))
-        temp_layout.add_widget(vitals_list_box)
-        home_btn = Button(text='Home', size_hint=(None, None), size=(120, 40), pos_hint={'center_x': 0.5})
-        home_btn.bind(on_press=self.go_home)
-        box = BoxLayout(size_hint=(1, None), height=60)
-        box.add_widget(Label())
-        box.add_widget(home_btn)
-        box.add_widget(Label())
-        temp_layout.add_widget(box)
-        self.add_widget(temp_layout)
+        # Rendered from the local store; one extra row tells us whether there is more
+        vitals = self.store.vitals(limit=6)
+        if not vitals and self.store.get_meta("cursor") is None:
+            # First sync still running in the background
+            self.vitals_list.set_rows(["Loading..."])
+        else:
+            self.vitals_list.set_rows([vital_row_text(v) for v in vitals[:5]])
+        self.show_more_vitals_btn.opacity = 1 if len(vitals) > 5 else 0
+    def show_all_vitals(self, instance=None):
+        self.show_view(self.all_vitals_layout)
+        self.all_vitals_list.set_rows([vital_row_text(v) for v in self.store.vitals()])
     def open_add_med(self, instance):
         self.manager.current = "add_med"
         self.manager.get_screen("add_med").set_token(self.token)
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.token = None
-        print("DEBUG: MainScreen __init__ called")
+        self.current_view = None
+        # Each view is built once; switching views and new data only swap layouts and data models
+        self.home_layout = self.build_home()
+        self.all_meds_layout, self.all_meds_list = self.build_full_list('All Medications')
+        self.all_vitals_layout, self.all_vitals_list = self.build_full_list('All Vitals')
+
+    def build_home(self):
         layout = BoxLayout(orientation='vertical', padding=[0,10,10,10], spacing=5)
-        welcome_label = Label(text='Welcome to MedBuddy!', font_size=20, size_hint=(1, None), height=30)
-        reminder_label = Label(text='', font_size=40, size_hint=(1, None), height=60)
-        try:
-            reminder_label.bold = True
-        except Exception:
-            pass
+        # Centered welcome label and user email label
+        welcome_label = Label(text='Welcome to MedBuddy!', font_size=20, size_hint=(1, None), height=40, halign='center', valign='middle')
+        welcome_label.bind(size=welcome_label.setter('text_size'))
+        layout.add_widget(welcome_label)
+        user_label = Label(text='', font_size=18, size_hint=(1, None), height=30, halign='center', valign='middle')
+        user_label.bind(size=user_label.setter('text_size'))
+        layout.add_widget(user_label)
+        reminder_label = Label(text='', font_size=30, size_hint=(1, None), height=60)
+        layout.add_widget(reminder_label)
+        # Writes the server refused; empty (and the button hidden) while there are none
+        failed_label = Label(text='', size_hint=(1, None), height=40, color=(1, 0.4, 0.4, 1), halign='center', valign='middle')
+        failed_label.bind(size=failed_label.setter('text_size'))
+        dismiss_failed_btn = Button(text='Dismiss', size_hint=(None, None), size=(100, 30), pos_hint={'center_x': 0.5})
+        dismiss_failed_btn.bind(on_press=self.dismiss_failed_writes)
+        layout.add_widget(failed_label)
+        layout.add_widget(dismiss_failed_btn)
+
         med_label = Label(text='Medications:', size_hint=(1, None), height=25)
-        med_list = GridLayout(cols=1, size_hint_y=None)
-        med_list.bind(minimum_height=med_list.setter('height'))
+        med_list = RowList(max_rows=5, size_hint_y=None)
         show_more_med_btn = Button(text='Show More', size_hint=(None, None), size=(100, 30), pos_hint={'center_x': 0.5})
         show_more_med_btn.bind(on_press=self.show_all_meds)
         add_med_btn = Button(text='Add Medication', size_hint=(1, None), height=40)
         add_med_btn.bind(on_press=self.open_add_med)
         vitals_label = Label(text='Vitals:', size_hint=(1, None), height=25)
-        vitals_list = GridLayout(cols=1, size_hint_y=None)
-        vitals_list.bind(minimum_height=vitals_list.setter('height'))
+        vitals_list = RowList(max_rows=5, size_hint_y=None)
         show_more_vitals_btn = Button(text='Show More', size_hint=(None, None), size=(120, 40), pos_hint={'center_x': 0.5})
         show_more_vitals_btn.bind(on_press=self.show_all_vitals)
         add_vitals_btn = Button(text='Add Vitals', size_hint=(1, None), height=40)
         add_vitals_btn.bind(on_press=self.open_add_vitals)
         logout_btn = Button(text='Logout', size_hint=(1, None), height=40)
         logout_btn.bind(on_press=self.logout)
-        layout.add_widget(welcome_label)
-        layout.add_widget(reminder_label)
         layout.add_widget(med_label)
         layout.add_widget(med_list)
         layout.add_widget(show_more_med_btn)
         layout.add_widget(vitals_label)
         layout.add_widget(vitals_list)
         layout.add_widget(show_more_vitals_btn)
-        from kivy.uix.widget import Widget
         layout.add_widget(Widget(size_hint_y=1))
         button_box = BoxLayout(orientation='horizontal', size_hint=(1, None), height=50, padding=10, spacing=10)
         button_box.add_widget(add_med_btn)
         button_box.add_widget(add_vitals_btn)
         button_box.add_widget(logout_btn)
         layout.add_widget(button_box)
-        self.add_widget(layout)
-        self.layout = layout
         self.welcome_label = welcome_label
+        self.user_label = user_label
         self.reminder_label = reminder_label
+        self.failed_label = failed_label
+        self.dismiss_failed_btn = dismiss_failed_btn
         self.med_label = med_label
         self.med_list = med_list
         self.show_more_med_btn = show_more_med_btn
@@ -184,204 +685,110 @@ class MainScreen(Screen):
         self.show_more_vitals_btn = show_more_vitals_btn
         self.add_vitals_btn = add_vitals_btn
         self.logout_btn = logout_btn
-        self.med_list.bind(minimum_height=self.med_list.setter('height'))
-        self.show_more_med_btn = Button(text='Show More', size_hint=(None, None), size=(100, 30), pos_hint={'center_x': 0.5})
-        self.show_more_med_btn.bind(on_press=self.show_all_meds)
-
-        self.add_med_btn = Button(text='Add Medication', size_hint=(1, None), height=40)
-        self.add_med_btn.bind(on_press=self.open_add_med)
-
-        self.vitals_label = Label(text='Vitals:', size_hint=(1, None), height=25)
-        self.vitals_list = GridLayout(cols=1, size_hint_y=None)
-        self.vitals_list.bind(minimum_height=self.vitals_list.setter('height'))
-        self.show_more_vitals_btn = Button(text='Show More', size_hint=(None, None), size=(120, 40), pos_hint={'center_x': 0.5})
-        self.show_more_vitals_btn.bind(on_press=self.show_all_vitals)
+        return layout
 
-        self.add_vitals_btn = Button(text='Add Vitals', size_hint=(1, None), height=40)
-        self.add_vitals_btn.bind(on_press=self.open_add_vitals)
-
-        self.logout_btn = Button(text='Logout', size_hint=(1, None), height=40)
-        self.logout_btn.bind(on_press=self.logout)
-
-    # ...existing code...
-
-    def set_token(self, token):
-        self.token = token
-        print(f"DEBUG: set_token called with token={token}")
-        self.go_home()
-
-    def show_medication(self):
-        self.med_list.clear_widgets()
-        headers = {"Authorization": f"Bearer {self.token}"}
-        try:
-            response = requests.get(f"{API_BASE}/meds", headers=headers)
-            if response.status_code == 200:
-                meds = response.json()
-                for med in meds[:5]:
-                    name = med.get('name', '')
-                    dose = med.get('dose', '')
-                    times = med.get('times', [])
-                    schedule = ", ".join(times) if isinstance(times, list) else str(times)
-                    start_date = med.get('start_date', '')
-                    end_date = med.get('end_date', '')
-                    med_text = f"Name: {name} | Dose: {dose} | Schedule: {schedule} | Start: {start_date} | End: {end_date}"
-                    med_label = Label(text=med_text, size_hint_y=None, height=40)
-                    self.med_list.add_widget(med_label)
-                self.show_more_med_btn.opacity = 1 if len(meds) > 5 else 0
-            else:
-                self.med_list.add_widget(Label(text="Failed to load medications", size_hint_y=None, height=30))
-        except Exception as e:
-            self.med_list.add_widget(Label(text=f"Error: {e}", size_hint_y=None, height=30))
-        
-    def show_all_meds(self, instance):
-        self.clear_widgets()
-        temp_layout = BoxLayout(orientation='vertical', padding=20, spacing=10)
-        # Center the med_list horizontally
-        med_list_box = BoxLayout(orientation='horizontal', size_hint=(1, None))
-        med_list_box.add_widget(Label(size_hint_x=0.25))
-        med_list = GridLayout(cols=1, size_hint=(0.5, None), width=250, padding=[0,10,0,0], spacing=5)
-        med_list.bind(minimum_height=med_list.setter('height'))
-    # ...existing code...
-        # Add the title label as the first item in the grid
-        title_label = Label(text='All Medications', font_size=18, size_hint=(None, None), width=250, height=50, halign='center', valign='middle')
+    def build_full_list(self, title):
+        layout = BoxLayout(orientation='vertical', padding=20, spacing=10)
+        title_label = Label(text=title, font_size=18, size_hint=(1, None), height=50, halign='center', valign='middle')
         title_label.bind(size=title_label.setter('text_size'))
-        med_list.add_widget(title_label)
-        headers = {"Authorization": f"Bearer {self.token}"}
-        try:
-            response = requests.get(f"{API_BASE}/meds", headers=headers)
-            if response.status_code == 200:
-                meds = response.json()
-                for med in meds:
-                    name = med.get('name', '')
-                    dose = med.get('dose', '')
-                    times = med.get('times', [])
-                    schedule = ", ".join(times) if isinstance(times, list) else str(times)
-                    start_date = med.get('start_date', '')
-                    end_date = med.get('end_date', '')
-                    med_text = f"Name: {name} | Dose: {dose} | Schedule: {schedule} | Start: {start_date} | End: {end_date}"
-                    med_label = Label(text=med_text, size_hint=(None, None), width=250, height=30, halign='center', valign='middle')
-                    med_label.bind(size=med_label.setter('text_size'))
-                    med_list.add_widget(med_label)
-            else:
-                med_list.add_widget(Label(text="Failed to load medications", size_hint=(None, None), width=250, height=30, halign='center', valign='middle'))
-        except Exception as e:
-            med_list.add_widget(Label(text=f"Error: {e}", size_hint=(None, None), width=250, height=30, halign='center', valign='middle'))
-        med_list_box.add_widget(med_list)
-        med_list_box.add_widget(Label(size_hint_x=0.25))
-        temp_layout.add_widget(med_list_box)
+        layout.add_widget(title_label)
+        # Center the list horizontally
+        list_box = BoxLayout(orientation='horizontal')
+        list_box.add_widget(Widget(size_hint_x=0.25))
+        rows = RowList(row_height=30, size_hint_x=0.5)
+        list_box.add_widget(rows)
+        list_box.add_widget(Widget(size_hint_x=0.25))
+        layout.add_widget(list_box)
         home_btn = Button(text='Home', size_hint=(None, None), size=(120, 40), pos_hint={'center_x': 0.5})
         home_btn.bind(on_press=self.go_home)
         box = BoxLayout(size_hint=(1, None), height=60)
         box.add_widget(Label())
         box.add_widget(home_btn)
         box.add_widget(Label())
-        temp_layout.add_widget(box)
-        self.add_widget(temp_layout)
+        layout.add_widget(box)
+        return layout, rows
+
+    def show_view(self, layout):
+        if self.current_view is not layout:
+            self.clear_widgets()
+            self.add_widget(layout)
+            self.current_view = layout
+
+    def set_token(self, token):
+        self.token = token
+        api.set_token(token)
+        self.store = App.get_running_app().store
+        self.go_home()
+        self.syncer = Syncer(self.store, self.on_store_change)
+        self.syncer.start()
+        self.reminder_check = Clock.schedule_interval(self.show_reminder, REMINDER_CHECK_SECONDS)
+        self.alarms = DoseAlarms(self.store, self.show_reminder)
+        self.alarms.sync()
 
-    def show_reminder(self):
-        if not hasattr(self, 'reminder_label'):
+    def on_store_change(self):
+        if not self.token:
             return
-        headers = {"Authorization": f"Bearer {self.token}"}
-        try:
-            response = requests.get(f"{API_BASE}/reminders", headers=headers)
-            if response.status_code == 200:
-                reminders = response.json()
-                if reminders:
-                    details = []
-                    for r in reminders:
-                        name = r.get('name', 'Unknown')
-                        dose = r.get('dose', '')
-                        sched = r.get('scheduled_for', '')
-                        details.append(f"{name} ({dose}) at {sched}")
-                    self.reminder_label.text = f"Reminders: {len(reminders)} medicines delayed!\n" + "\n".join(details)
-                else:
-                    self.reminder_label.text = "No reminders right now."
-            else:
-                self.reminder_label.text = "Failed to load reminders."
-        except Exception as e:
-            self.reminder_label.text = f"Error: {e}"
+        self.alarms.sync()
+        if self.current_view is self.all_meds_layout:
+            self.show_all_meds()
+        elif self.current_view is self.all_vitals_layout:
+            self.show_all_vitals()
+        else:
+            self.show_medication()
+            self.show_vitals()
+            self.show_reminder()
+            self.show_failed_writes()
 
-    def go_home(self, instance=None):
-        self.clear_widgets()
-        layout = BoxLayout(orientation='vertical', padding=[0,10,10,10], spacing=5)
-        # Centered welcome label and user email label
-        welcome_label = Label(text='Welcome to MedBuddy!', font_size=20, size_hint=(1, None), height=40, halign='center', valign='middle')
-        welcome_label.bind(size=welcome_label.setter('text_size'))
-        layout.add_widget(welcome_label)
-        if hasattr(self, 'user_email') and self.user_email:
-            user_label = Label(text=f'Welcome, {self.user_email}!', font_size=18, size_hint=(1, None), height=30, halign='center', valign='middle')
-            user_label.bind(size=user_label.setter('text_size'))
-            layout.add_widget(user_label)
-
-        # Reminder label (copied logic from show_reminder)
-            reminder_label = Label(text='', font_size=30, size_hint=(1, None), height=60)
-        headers = {"Authorization": f"Bearer {self.token}"}
-        try:
-            response = requests.get(f"{API_BASE}/reminders", headers=headers)
-            if response.status_code == 200:
-                reminders = response.json()
-                if reminders:
-                    details = []
-                    for r in reminders:
-                        name = r.get('name', 'Unknown')
-                        dose = r.get('dose', '')
-                        sched = r.get('scheduled_for', '')
-                        details.append(f"{name} ({dose}) at {sched}")
-                    reminder_label.text = f"Reminders: {len(reminders)} medicines delayed!\n" + "\n".join(details)
-                else:
-                    reminder_label.text = "No reminders right now."
-            else:
-                reminder_label.text = "Failed to load reminders."
-        except Exception as e:
-            reminder_label.text = f"Error: {e}"
-        layout.add_widget(reminder_label)
+    def show_failed_writes(self):
+        failed = self.store.failed_writes()
+        if failed:
+            self.failed_label.text = "Not saved, the server refused: " + ", ".join(
+                failed_write_text(path, body, status) for _, path, body, status in failed)
+        else:
+            self.failed_label.text = ""
+        self.dismiss_failed_btn.opacity = 1 if failed else 0
+        self.dismiss_failed_btn.disabled = not failed
 
-        med_label = Label(text='Medications:', size_hint=(1, None), height=25)
-        med_list = GridLayout(cols=1, size_hint_y=None)
-        med_list.bind(minimum_height=med_list.setter('height'))
-        show_more_med_btn = Button(text='Show More', size_hint=(None, None), size=(100, 30), pos_hint={'center_x': 0.5})
-        show_more_med_btn.bind(on_press=self.show_all_meds)
-        add_med_btn = Button(text='Add Medication', size_hint=(1, None), height=40)
-        add_med_btn.bind(on_press=self.open_add_med)
-        vitals_label = Label(text='Vitals:', size_hint=(1, None), height=25)
-        vitals_list = GridLayout(cols=1, size_hint_y=None)
-        vitals_list.bind(minimum_height=vitals_list.setter('height'))
-        show_more_vitals_btn = Button(text='Show More', size_hint=(None, None), size=(120, 40), pos_hint={'center_x': 0.5})
-        show_more_vitals_btn.bind(on_press=self.show_all_vitals)
-        add_vitals_btn = Button(text='Add Vitals', size_hint=(1, None), height=40)
-        add_vitals_btn.bind(on_press=self.open_add_vitals)
-        logout_btn = Button(text='Logout', size_hint=(1, None), height=40)
-        logout_btn.bind(on_press=self.logout)
-        layout.add_widget(med_label)
-        layout.add_widget(med_list)
-        layout.add_widget(show_more_med_btn)
-        layout.add_widget(vitals_label)
-        layout.add_widget(vitals_list)
-        layout.add_widget(show_more_vitals_btn)
-        from kivy.uix.widget import Widget
-        layout.add_widget(Widget(size_hint_y=1))
-        button_box = BoxLayout(orientation='horizontal', size_hint=(1, None), height=50, padding=10, spacing=10)
-        button_box.add_widget(add_med_btn)
-        button_box.add_widget(add_vitals_btn)
-        button_box.add_widget(logout_btn)
-        layout.add_widget(button_box)
-        self.add_widget(layout)
-        self.layout = layout
-        self.welcome_label = welcome_label
-        self.reminder_label = reminder_label
-        self.med_label = med_label
-        self.med_list = med_list
-        self.show_more_med_btn = show_more_med_btn
-        self.add_med_btn = add_med_btn
-        self.vitals_label = vitals_label
-        self.vitals_list = vitals_list
-        self.show_more_vitals_btn = show_more_vitals_btn
-        self.add_vitals_btn = add_vitals_btn
-        self.logout_btn = logout_btn
-        self.med_list.bind(minimum_height=self.med_list.setter('height'))
-        # Load data after widgets are initialized
+    def dismiss_failed_writes(self, instance):
+        self.store.dismiss_failed_writes()
+        self.show_failed_writes()
+
+    def show_medication(self):
+        meds = self.store.meds()
+        if not meds and self.store.get_meta("cursor") is None:
+            # First sync still running in the background
+            self.med_list.set_rows(["Loading..."])
+        else:
+            self.med_list.set_rows([med_row_text(m) for m in meds[:5]])
+        self.show_more_med_btn.opacity = 1 if len(meds) > 5 else 0
+
+    def show_all_meds(self, instance=None):
+        self.show_view(self.all_meds_layout)
+        self.all_meds_list.set_rows([med_row_text(m) for m in self.store.meds()])
+
+    def show_reminder(self, dt=None):
+        if not self.token:
+            return
+        reminders = self.store.due_reminders(datetime.now(timezone.utc))
+        if reminders:
+            details = []
+            for r in reminders:
+                name = r.get('name', 'Unknown')
+                dose = r.get('dose', '')
+                sched = r.get('scheduled_for', '')
+                details.append(f"{name} ({dose}) at {sched}")
+            self.reminder_label.text = f"Reminders: {len(reminders)} medicines delayed!\n" + "\n".join(details)
+        else:
+            self.reminder_label.text = "No reminders right now."
+
+    def go_home(self, instance=None):
+        self.show_view(self.home_layout)
+        self.user_label.text = f'Welcome, {self.user_email}!' if getattr(self, 'user_email', None) else ''
+        # Load data into the existing widgets
+        self.show_reminder()
         self.show_medication()
         self.show_vitals()
+        self.show_failed_writes()
         self.manager.get_screen("add_med").set_token(self.token)
 
     def open_add_vitals(self, instance):
@@ -389,7 +796,15 @@ class MainScreen(Screen):
         self.manager.get_screen("add_vitals").set_token(self.token)
 
     def logout(self, instance):
+        self.alarms.cancel()
+        self.syncer.stop()
+        self.reminder_check.cancel()
         self.token = None
+        api.set_token(None)
+        # Queued writes stay on disk and go out after the next login
+        app = App.get_running_app()
+        app.store.close()
+        app.store = None
         login_screen = self.manager.get_screen("login")
         login_screen.email_input.text = ""
         login_screen.password_input.text = ""
@@ -432,7 +847,6 @@ class AddMedScreen(Screen):
         start_date = self.start_date_input.text.strip()
         end_date = self.end_date_input.text.strip()
         quantity = self.quantity_input.text.strip()
-        headers = {"Authorization": f"Bearer {self.token}"}
         times = [t.strip() for t in times_raw.split(",") if t.strip()]
         med_data = {"name": name, "dose": dose, "times": times}
         if start_date:
@@ -445,24 +859,33 @@ class AddMedScreen(Screen):
             except ValueError:
                 self.message_label.text = "Quantity must be a number."
                 return
+        # Queued writes are replayed later, so catch what the server would reject now
         try:
-            response = requests.post(f"{API_BASE}/meds", json=med_data, headers=headers)
-            if response.status_code == 200 or response.status_code == 201:
-                self.message_label.text = "Medication added!"
-                # Clear form fields after successful add
-                self.name_input.text = ""
-                self.dosage_input.text = ""
-                self.times_input.text = ""
-                self.start_date_input.text = ""
-                self.end_date_input.text = ""
-                self.quantity_input.text = ""
-                # Go back to main screen and refresh meds
-                self.manager.current = "main"
-                self.manager.get_screen("main").show_medication()
-            else:
-                self.message_label.text = "Failed to add medication."
-        except Exception as e:
-            self.message_label.text = f"Error: {e}"
+            for t in times:
+                datetime.strptime(t, "%H:%M")
+            for d in (start_date, end_date):
+                if d:
+                    datetime.strptime(d, "%Y-%m-%d")
+        except ValueError:
+            self.message_label.text = "Use HH:MM times and YYYY-MM-DD dates."
+            return
+        # Saved locally first; the main screen's Syncer sends it when the network allows
+        App.get_running_app().store.enqueue("POST", "/meds", med_data)
+        self.message_label.text = "Medication added!"
+        # Clear form fields after successful add
+        self.name_input.text = ""
+        self.dosage_input.text = ""
+        self.times_input.text = ""
+        self.start_date_input.text = ""
+        self.end_date_input.text = ""
+        self.quantity_input.text = ""
+        # Go back to main screen and refresh meds
+        self.manager.current = "main"
+        main_screen = self.manager.get_screen("main")
+        main_screen.show_medication()
+        main_screen.show_reminder()
+        main_screen.alarms.sync()
+        main_screen.syncer.poke()
 
     def go_back(self, instance):
         self.manager.current = "main"
@@ -492,11 +915,9 @@ class AddVitalsScreen(Screen):
         self.token = token
 
     def save_vitals(self, instance):
-        import datetime
         bp = self.bp_input.text.strip()
         hr = self.hr_input.text.strip()
         temp = self.temp_input.text.strip()
-        headers = {"Authorization": f"Bearer {self.token}"}
         if not (bp or hr or temp):
             self.message_label.text = "Please enter at least one value."
             return
@@ -504,22 +925,19 @@ class AddVitalsScreen(Screen):
             "bp": bp if bp else None,
             "hr": hr if hr else None,
             "temp": temp if temp else None,
-            "record_time": datetime.datetime.now().isoformat()
+            "record_time": datetime.now().isoformat()
         }
-        try:
-            response = requests.post(f"{API_BASE}/vitals", json=vital_data, headers=headers)
-            if response.status_code == 200:
-                self.message_label.text = "Vitals added!"
-                self.manager.get_screen("main").show_vitals()
-                # Clear form fields after successful add
-                self.bp_input.text = ""
-                self.hr_input.text = ""
-                self.temp_input.text = ""
-                self.manager.current = "main"
-            else:
-                self.message_label.text = "Failed to add vitals."
-        except Exception as e:
-            self.message_label.text = f"Error: {e}"
+        # Saved locally first; record_time makes a replay after a lost response a harmless 409
+        App.get_running_app().store.enqueue("POST", "/vitals", vital_data)
+        self.message_label.text = "Vitals added!"
+        main_screen = self.manager.get_screen("main")
+        main_screen.show_vitals()
+        main_screen.syncer.poke()
+        # Clear form fields after successful add
+        self.bp_input.text = ""
+        self.hr_input.text = ""
+        self.temp_input.text = ""
+        self.manager.current = "main"
 
     def go_back(self, instance):
         self.manager.current = "main"
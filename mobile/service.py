@@ -0,0 +1,12 @@
+"""Dose-alarm service: started by the AlarmManager alarms main.py arms, it posts that dose instant's notifications.
+
+Declared in buildozer.spec as `services = Dosealarm:service.py`. python-for-android passes the JSON list of
+[title, message] pairs built by AndroidAlarms in PYTHON_SERVICE_ARGUMENT; the service ends once they are posted.
+"""
+import os
+import json
+
+from plyer import notification
+
+for title, message in json.loads(os.environ.get("PYTHON_SERVICE_ARGUMENT") or "[]"):
+    notification.notify(title=title, message=message, app_name="MedBuddy")